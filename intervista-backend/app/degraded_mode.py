@@ -0,0 +1,68 @@
+# app/degraded_mode.py
+"""
+Degraded-mode switch for the interview service.
+
+When degraded, turns are served entirely locally (local_scorer) instead of
+calling the LLM. Degraded mode is on when any of these hold:
+ - DEGRADED_MODE=1 is set in the environment (manual switch)
+ - LLM calls failed DEGRADED_FAILURE_THRESHOLD times in a row; the service
+   then stays degraded for DEGRADED_COOLDOWN_SECONDS before trying again
+ - the scheduler rejected interactive work (queue full or turn deadline out
+   of reach); the service then stays degraded for DEGRADED_OVERLOAD_SECONDS
+   so following turns are answered locally instead of with a 503
+"""
+
+from typing import Dict
+import os
+import time
+
+DEGRADED_FAILURE_THRESHOLD = int(os.getenv("DEGRADED_FAILURE_THRESHOLD", "3"))
+DEGRADED_COOLDOWN_SECONDS = float(os.getenv("DEGRADED_COOLDOWN_SECONDS", "30"))
+DEGRADED_OVERLOAD_SECONDS = float(os.getenv("DEGRADED_OVERLOAD_SECONDS", "10"))
+
+_state = {
+    "consecutive_failures": 0,
+    "degraded_until": 0.0,
+    "reason": "",
+    "trips": 0,
+}
+
+
+def is_degraded() -> bool:
+    if os.getenv("DEGRADED_MODE", "0") == "1":
+        return True
+    return time.monotonic() < _state["degraded_until"]
+
+
+def enter_degraded_mode(reason: str, seconds: float = DEGRADED_COOLDOWN_SECONDS) -> None:
+    now = time.monotonic()
+    if now >= _state["degraded_until"]:
+        # count transitions into degraded mode, not every extension
+        _state["trips"] += 1
+    _state["degraded_until"] = max(_state["degraded_until"], now + seconds)
+    _state["reason"] = reason
+
+
+def record_llm_success() -> None:
+    _state["consecutive_failures"] = 0
+
+
+def record_llm_failure() -> None:
+    _state["consecutive_failures"] += 1
+    if _state["consecutive_failures"] >= DEGRADED_FAILURE_THRESHOLD:
+        _state["consecutive_failures"] = 0
+        enter_degraded_mode("llm_failures")
+
+
+def record_overload() -> None:
+    """Called by the scheduler when it turns interactive work away."""
+    enter_degraded_mode("overload", DEGRADED_OVERLOAD_SECONDS)
+
+
+def get_degraded_state() -> Dict:
+    return {
+        "degraded": is_degraded(),
+        "reason": _state["reason"] if is_degraded() else "",
+        "consecutive_failures": _state["consecutive_failures"],
+        "trips": _state["trips"],
+    }
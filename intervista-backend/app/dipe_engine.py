@@ -8,20 +8,27 @@ Simple but extensible logic to pick the next question type based on:
  - simple randomness for variety
 """
 
-from typing import Dict
+from typing import Dict, List
 import random
 
-def choose_next_type(last_quick_feedback: Dict, turn_count: int) -> str:
-    """
-    Decide next question type.
+# Scores below this threshold trigger a targeted probe for that competency
+ROUTE_THRESHOLD = 6
+# Turn count from which DIPE starts to wrap the interview up
+WRAP_UP_TURN = 8
+# Competency -> route, checked in priority order
+ROUTE_ORDER = [
+    ("technical", "technical"),
+    ("problem_solving", "problem_solving"),
+    ("behavioral", "behavioral"),
+    ("communication", "follow_up"),
+]
+# Variety routes used when no competency needs probing
+VARIETY_CHOICES = ["technical", "behavioral", "follow_up", "problem_solving"]
+# weigh technical slightly higher
+VARIETY_WEIGHTS = [0.35, 0.25, 0.2, 0.2]
 
-    Returns one of:
-      "technical", "behavioral", "follow_up", "problem_solving", "wrap_up"
-    """
-    # safe defaults
-    if not last_quick_feedback or not isinstance(last_quick_feedback, dict):
-        return "behavioral" if random.random() < 0.5 else "technical"
 
+def _competency_scores(last_quick_feedback: Dict) -> Dict[str, float]:
     comp = last_quick_feedback.get("competency_scores") or last_quick_feedback.get("scores") or {}
     # normalize values (0-10 expected)
     def get_score(k):
@@ -31,33 +38,61 @@ def choose_next_type(last_quick_feedback: Dict, turn_count: int) -> str:
         except Exception:
             return 5.0
 
-    tech = get_score("technical")
-    comm = get_score("communication")
-    prob = get_score("problem_solving")
-    beh = get_score("behavioral")
+    return {k: get_score(k) for k, _ in ROUTE_ORDER}
 
-    # If the candidate is weak technically -> technical probe
-    if tech < 6:
-        return "technical"
 
-    # If problem solving low -> problem solving question
-    if prob < 6:
-        return "problem_solving"
+def choose_next_type(last_quick_feedback: Dict, turn_count: int) -> str:
+    """
+    Decide next question type.
+
+    Returns one of:
+      "technical", "behavioral", "follow_up", "problem_solving", "wrap_up"
+    """
+    # safe defaults
+    if not last_quick_feedback or not isinstance(last_quick_feedback, dict):
+        return "behavioral" if random.random() < 0.5 else "technical"
 
-    # If behavioral low -> probe behavioral
-    if beh < 6:
-        return "behavioral"
+    scores = _competency_scores(last_quick_feedback)
 
-    # If communication low -> follow up for clarity
-    if comm < 6:
-        return "follow_up"
+    # Probe the first competency (in priority order) that scored low:
+    # technical -> problem_solving -> behavioral -> communication (follow up)
+    for competency, route in ROUTE_ORDER:
+        if scores[competency] < ROUTE_THRESHOLD:
+            return route
 
     # If many turns already -> consider wrap up or problem solving
-    if turn_count >= 8:
+    if turn_count >= WRAP_UP_TURN:
         return "wrap_up"
 
     # otherwise alternate for variety
-    choices = ["technical", "behavioral", "follow_up", "problem_solving"]
-    # weigh technical slightly higher
-    weights = [0.35, 0.25, 0.2, 0.2]
-    return random.choices(choices, weights, k=1)[0]
+    return random.choices(VARIETY_CHOICES, VARIETY_WEIGHTS, k=1)[0]
+
+
+def likely_next_types(last_quick_feedback: Dict, turn_count: int, k: int = 2,
+                      margin: float = 1.5) -> List[str]:
+    """
+    Rank the routes choose_next_type() is most likely to pick on the *next*
+    turn (turn_count is the upcoming turn), most likely first.
+
+    The next answer is not known yet, so competencies scoring within `margin`
+    of ROUTE_THRESHOLD are treated as candidates alongside the route that
+    would win today.
+    """
+    ranked: List[str] = []
+
+    def add(route):
+        if route not in ranked:
+            ranked.append(route)
+
+    if last_quick_feedback and isinstance(last_quick_feedback, dict):
+        scores = _competency_scores(last_quick_feedback)
+        for competency, route in ROUTE_ORDER:
+            if scores[competency] < ROUTE_THRESHOLD + margin:
+                add(route)
+        if turn_count >= WRAP_UP_TURN:
+            add("wrap_up")
+
+    for route, _ in sorted(zip(VARIETY_CHOICES, VARIETY_WEIGHTS), key=lambda x: -x[1]):
+        add(route)
+
+    return ranked[:max(k, 0)]
@@ -5,6 +5,15 @@ from pydantic import BaseModel
 from typing import List, Dict, Any
 
 from .interview_service import run_interview_turn
+from .speculation import get_speculation_metrics, session_state_key
+from .llm_router import get_router_metrics
+from .idempotency import turn_results
+from .degraded_mode import get_degraded_state
+from .scheduler import SchedulerRejected, get_scheduler_metrics
+from .shared_state import WriteBatch, get_state_metrics, read_many
+from .prompt_assembly import get_prompt_metrics
+from .traffic_capture import finish_capture, start_capture
+from .similarity_index import get_similarity_metrics, similarity_state_key
 
 router = APIRouter()
 
@@ -16,6 +25,8 @@ class InterviewRequest(BaseModel):
     user_answer: str = ""
     history: List[Dict[str, Any]] = []
     turn_count: int = 1  # optional – useful later if you track turns in DB
+    session_id: str = ""  # optional – enables per-session speculative pre-generation
+    client_turn_id: str = ""  # optional – idempotency key; duplicates reuse the first result
 
 
 @router.post("/interview")
@@ -28,16 +39,70 @@ async def interview(req: InterviewRequest):
         - Reflection engine
         - Next question generation
     """
+    cap = start_capture(req.model_dump())
+    status = 200
     try:
-        result = await run_interview_turn(
-            role=req.role,
-            question_context=req.question_context,
-            last_question=req.last_question,
-            user_answer=req.user_answer,
-            history=req.history,
-            turn_count=req.turn_count,
-        )
+        # Load all shared state this turn needs in one batched round-trip
+        turn_key = f"{req.session_id}:{req.client_turn_id}"
+        keys = []
+        if req.client_turn_id:
+            keys.append(turn_results.storage_key(turn_key))
+        if req.session_id:
+            keys.append(session_state_key(req.session_id))
+            keys.append(similarity_state_key(req.session_id))
+        state = await read_many(keys)
+
+        async def run_turn():
+            # everything the turn persists goes out in one background write
+            writes = WriteBatch()
+            result = await run_interview_turn(
+                role=req.role,
+                question_context=req.question_context,
+                last_question=req.last_question,
+                user_answer=req.user_answer,
+                history=req.history,
+                turn_count=req.turn_count,
+                session_id=req.session_id,
+                shared_session=state.get(session_state_key(req.session_id)),
+                shared_similarity=state.get(similarity_state_key(req.session_id)),
+                writes=writes,
+            )
+            if req.client_turn_id:
+                turn_results.persist(turn_key, result, writes)
+            writes.flush()
+            return result
+
+        if req.client_turn_id:
+            stored = state.get(turn_results.storage_key(turn_key))
+            result = await turn_results.run(turn_key, run_turn, stored=stored)
+        else:
+            result = await run_turn()
         return result
 
+    except SchedulerRejected as e:
+        # overloaded: fail fast so the client can retry instead of timing out
+        status = 503
+        raise HTTPException(status_code=503, detail=str(e),
+                            headers={"Retry-After": str(e.retry_after)})
     except Exception as e:
+        status = 500
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        finish_capture(cap, status)
+
+
+@router.get("/metrics")
+async def metrics():
+    """
+    Runtime counters for the interview service.
+    """
+    return {
+        "speculation": get_speculation_metrics(),
+        "llm": get_router_metrics(),
+        "idempotency": turn_results.snapshot(),
+        "degraded_mode": get_degraded_state(),
+        "scheduler": get_scheduler_metrics(),
+        "shared_state": get_state_metrics(),
+        "prompts": get_prompt_metrics(),
+        "similarity": get_similarity_metrics(),
+    }
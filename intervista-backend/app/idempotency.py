@@ -0,0 +1,144 @@
+# app/idempotency.py
+"""
+Idempotent turn submission.
+
+The frontend can submit the same answer twice (text_input on_change and the
+"Speak Answer" button, or a Streamlit rerun). Each duplicate would cost up to
+three LLM calls, so turns carrying a client turn ID are deduplicated:
+
+ - a duplicate arriving while the first submission is in flight awaits the
+   same result
+ - a duplicate arriving after completion gets the stored result from the
+   shared-state backend (bounded and TTL-evicted), so it is found even when
+   it lands on another worker
+
+In-flight de-duplication is per worker; completed results are shared. The
+turn factory adds its result to the turn's WriteBatch (see persist()), so it
+reaches the shared store in the same write as the rest of the turn's state.
+Each worker also keeps its own recently completed results
+(IDEMPOTENCY_LOCAL_MAX, same TTL), which covers the window before that
+background write has landed. Failed turns are not stored, so a retry after
+an error runs again.
+"""
+
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+from collections import OrderedDict
+import asyncio
+import os
+import time
+
+from .shared_state import WriteBatch, read_many, state_key
+
+IDEMPOTENCY_TTL_SECONDS = float(os.getenv("IDEMPOTENCY_TTL_SECONDS", "900"))
+IDEMPOTENCY_LOCAL_MAX = int(os.getenv("IDEMPOTENCY_LOCAL_MAX", "1000"))
+
+_UNSET = object()
+
+
+class TurnResultStore:
+    """In-flight de-duplication plus TTL-bounded storage of completed turn results."""
+
+    def __init__(self, ttl_seconds: float = IDEMPOTENCY_TTL_SECONDS,
+                 local_max: int = IDEMPOTENCY_LOCAL_MAX):
+        self.ttl_seconds = ttl_seconds
+        self.local_max = local_max
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._recent: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self.metrics = {"executed": 0, "inflight_hits": 0, "recent_hits": 0, "stored_hits": 0}
+
+    @staticmethod
+    def storage_key(key: str) -> str:
+        return state_key("turn", key)
+
+    async def get(self, key: str) -> Optional[Any]:
+        skey = self.storage_key(key)
+        return (await read_many([skey])).get(skey)
+
+    def persist(self, key: str, result: Any, writes: WriteBatch) -> None:
+        """Add a completed result to the turn's shared-state writes."""
+        writes.add(self.storage_key(key), result, ttl=self.ttl_seconds)
+
+    def put(self, key: str, result: Any) -> None:
+        """Remember a completed result on this worker."""
+        self._recent[key] = (time.monotonic() + self.ttl_seconds, result)
+        self._recent.move_to_end(key)
+        while len(self._recent) > self.local_max:
+            self._recent.popitem(last=False)
+
+    def _get_recent(self, key: str) -> Optional[Any]:
+        entry = self._recent.get(key)
+        if entry is None:
+            return None
+        expires, result = entry
+        if expires <= time.monotonic():
+            del self._recent[key]
+            return None
+        return result
+
+    def _existing(self, key: str) -> Tuple[Optional[asyncio.Task], Optional[Any]]:
+        """In-flight task or locally completed result for `key`, if any."""
+        task = self._inflight.get(key)
+        if task is not None:
+            self.metrics["inflight_hits"] += 1
+            return task, None
+        result = self._get_recent(key)
+        if result is not None:
+            self.metrics["recent_hits"] += 1
+        return None, result
+
+    async def run(self, key: str, factory: Callable[[], Awaitable[Any]], stored: Any = _UNSET) -> Any:
+        """
+        Return the result for `key`, running `factory()` at most once for
+        concurrent and repeated submissions. Pass `stored` when the caller has
+        already fetched the stored result as part of a larger batched read.
+        """
+        task, result = self._existing(key)
+        if task is not None:
+            # shield: a disconnecting duplicate must not cancel the original
+            return await asyncio.shield(task)
+        if result is not None:
+            return result
+
+        if stored is _UNSET:
+            stored = await self.get(key)
+        if stored is not None:
+            self.metrics["stored_hits"] += 1
+            return stored
+
+        # a duplicate may have started or finished while we were reading the store
+        task, result = self._existing(key)
+        if task is not None:
+            return await asyncio.shield(task)
+        if result is not None:
+            return result
+
+        task = asyncio.create_task(factory())
+        self._inflight[key] = task
+        self.metrics["executed"] += 1
+        try:
+            result = await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if task.done():
+                self._inflight.pop(key, None)
+            else:
+                # the caller went away; keep the work and clean up when it ends
+                task.add_done_callback(lambda t: self._finish(key, t))
+            raise
+        except Exception:
+            self._inflight.pop(key, None)
+            raise
+        # record the result locally before the in-flight entry goes away
+        self.put(key, result)
+        self._inflight.pop(key, None)
+        return result
+
+    def _finish(self, key: str, task: asyncio.Task) -> None:
+        if not task.cancelled() and task.exception() is None:
+            self.put(key, task.result())
+        self._inflight.pop(key, None)
+
+    def snapshot(self) -> Dict[str, int]:
+        return {**self.metrics, "inflight": len(self._inflight), "recent": len(self._recent)}
+
+
+turn_results = TurnResultStore()
@@ -1,51 +1,102 @@
 # app/interview_service.py
 """
 Main interview orchestration:
- - Create structured prompt for quick micro-feedback
- - Call the LLM via utils.call_gemini_chat
+ - Assemble the structured prompt for quick micro-feedback (prompt_assembly)
+ - Call the LLM via utils.call_gemini_chat (or score locally for trivial
+   answers and in degraded mode, flagged as provisional)
  - Parse/validate JSON output
  - Use DIPE to choose next question type
- - Generate the next question (via LLM)
- - Call reflection service (lightweight) to get reflection signals
+ - Generate the next question (via LLM, or reuse a speculative pre-generation)
+ - Call reflection service (lightweight) to get reflection signals (skipped
+   for trivial answers and in degraded mode)
  - Return a single structured dict ready to be returned from endpoint
 """
 
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional, Tuple
 import json
 import asyncio
+import time
 
-from .prompts import render_interview_prompt, render_feedback_prompt
+from .prompt_assembly import assemble_interview_turn, assemble_question_gen
 from .utils import call_gemini_chat
-from .dipe_engine import choose_next_type
+from .dipe_engine import choose_next_type, likely_next_types
 from .reflection_service import reflect_and_recommend
+from .speculation import schedule_speculation, take_speculated_question
+from .local_scorer import is_trivial_answer, local_quick_feedback, local_question, local_question_options
+from .degraded_mode import is_degraded
+from .scheduler import SchedulerRejected
+from .shared_state import WriteBatch
+from .traffic_capture import record_stage
+from .similarity_index import (
+    SIMILARITY_ENABLED, SIMILARITY_QUESTION_THRESHOLD, SessionIndex, commit_turn,
+    least_similar, record_question_check, score_answer, session_index,
+)
 
-# Prompt wrapper that forces JSON for the interview turn
-STRUCTURED_INTERVIEW_INSTRUCTION = """
-You are a professional interviewer. You MUST return JSON only (no surrounding explanation).
-Return an object with the following keys:
-- interviewer_reply: string (1-2 sentence follow-up question or hint)
-- quick_feedback: {
-    "score": integer 0-10,
-    "strengths": [string],
-    "improvements": [string],
-    "competency_scores": {
-        "communication": 0-10,
-        "technical": 0-10,
-        "problem_solving": 0-10,
-        "behavioral": 0-10
+async def generate_question(qtype: str, role: str, user_answer: str, question_context: str = "",
+                            call_site: str = "question_gen", avoid: str = "") -> str:
+    """
+    Generate a single next-question string of the given DIPE type.
+    `avoid` is an earlier question the new one must not repeat.
+    """
+    qgen_prompt = assemble_question_gen(qtype, role, user_answer, question_context, avoid=avoid)
+    next_q_raw = await call_gemini_chat(qgen_prompt.body, call_site=call_site,
+                                        cache_prefix=qgen_prompt.cache_prefix)
+    if (next_q_raw or "").startswith("Error:"):
+        raise RuntimeError(next_q_raw)
+    # the question should be a single sentence; strip extra whitespace
+    next_question = (next_q_raw or "").strip().strip('"').strip("'")
+    # If LLM returned JSON or paragraphs, extract first line
+    if "\n" in next_question:
+        next_question = next_question.splitlines()[0].strip()
+    # ensure it ends with '?'
+    if not next_question.endswith('?'):
+        next_question = next_question.rstrip('.') + '?'
+    return next_question
+
+async def _avoid_repeated_question(index: SessionIndex, next_question: str, next_type: str,
+                                   role: str, user_answer: str, question_context: str,
+                                   degraded: bool) -> Tuple[str, Dict[str, Any]]:
+    """
+    If `next_question` is a near-duplicate of a question already asked this
+    session, regenerate it once (told what to avoid), then fall back to the
+    least similar local-bank question of the same type.
+    """
+    score, closest = index.question_similarity(next_question)
+    first_score = score
+    regenerated = False
+    if score >= SIMILARITY_QUESTION_THRESHOLD and not degraded:
+        try:
+            candidate = await generate_question(next_type, role, user_answer, question_context,
+                                                avoid=closest)
+            candidate_score, _ = index.question_similarity(candidate)
+            if candidate_score < score:
+                next_question, score, regenerated = candidate, candidate_score, True
+        except Exception as e:
+            print(f"Question regeneration failed: {str(e)}")
+    replaced_local = False
+    if score >= SIMILARITY_QUESTION_THRESHOLD:
+        candidate, candidate_score = least_similar(index, local_question_options(next_type, role))
+        if candidate is not None and candidate_score < score:
+            next_question, score, replaced_local = candidate, candidate_score, True
+    record_question_check(first_score, regenerated, replaced_local)
+    return next_question, {
+        "question_max": round(score, 3),
+        "question_max_before": round(first_score, 3),
+        "question_regenerated": regenerated or replaced_local,
     }
-}
-Return JSON only.
-"""
 
-QUESTION_GEN_INSTRUCTION = """
-You are an interviewer. Return a interview question (one sentence) of the requested type.
-Type: {qtype}
-Role: {role}
-User Answer: {user_answer}
-Context (optional): {context}
-Return only the question text.
-"""
+
+def _local_reply(role: str, user_answer: str, last_question: str) -> str:
+    """
+    Interviewer reply used when the structured LLM call is skipped or failed.
+    """
+    if not (user_answer or "").strip():
+        if not last_question:
+            return f"Welcome to your {role} mock interview. Let's get started."
+        return "Take your time, and answer whenever you're ready."
+    if is_trivial_answer(user_answer):
+        return "Thanks. Could you walk me through that in a bit more detail?"
+    return "Thanks for your answer. Could you give a bit more detail on how you approached it?"
 
 def _extract_json_from_text(text: str):
     """
@@ -80,7 +131,11 @@ async def run_interview_turn(role: str,
                              last_question: str,
                              user_answer: str,
                              history: List[Dict[str, str]] = None,
-                             turn_count: int = 1) -> Dict[str, Any]:
+                             turn_count: int = 1,
+                             session_id: str = "",
+                             shared_session: Dict[str, Any] = None,
+                             shared_similarity: Dict[str, Any] = None,
+                             writes: Optional[WriteBatch] = None) -> Dict[str, Any]:
     """
     Orchestrates a single interview step and returns structured response:
     {
@@ -88,91 +143,168 @@ async def run_interview_turn(role: str,
       question_type: str,
       micro_feedback: {...},
       dipe_state: {...},
-      reflection_signal: {...}
+      reflection_signal: {...},
+      similarity: {...}
     }
+
+    `shared_session` is the session's shared-state record (loaded by the
+    caller in its single batched read), used to reuse pre-generated questions
+    produced on another worker. `shared_similarity` is the session's
+    question/answer record for the similarity index, loaded the same way.
+    Shared-state updates go into `writes` so the caller can persist the
+    whole turn with one write.
     """
     history = history or []
-    # 1) Render the interview prompt (base) and add instruction to produce JSON
-    base_prompt = render_interview_prompt(
-        role=role,
-        question_context=question_context,
-        last_question=last_question,
-        user_answer=user_answer,
-        history=history
-    )
-
-    full_prompt = STRUCTURED_INTERVIEW_INSTRUCTION + "\n\n" + base_prompt
-
-    # 2) Call LLM for structured micro-feedback + interviewer reply
-    raw = await call_gemini_chat(full_prompt)
-    parsed = _extract_json_from_text(raw)
-
-    # If parsing failed, attempt to salvage by asking LLM to reformat
-    if parsed is None:
-        # Ask LLM to convert its previous answer to JSON only
-        salvage_prompt = f"Please reformat the following into valid JSON with keys interviewer_reply and quick_feedback only:\n\n{raw}\n\nJSON:"
-        salvage_raw = await call_gemini_chat(salvage_prompt)
-        parsed2 = _extract_json_from_text(salvage_raw)
-        parsed = parsed2 if parsed2 is not None else None
-
-    if parsed is None:
-        # Fallback defaults
-        interviewer_reply = f"Thanks for your answer. Could you give more detail about the architecture you used?"
-        quick_feedback = {
-            "score": None,
-            "strengths": [],
-            "improvements": [],
-            "competency_scores": {}
-        }
+    turn_started = stage_started = time.perf_counter()
+    degraded = is_degraded()
+    # Trivial answers (including the empty first turn) and degraded mode are
+    # scored locally and skip reflection instead of spending LLM calls
+    trivial = is_trivial_answer(user_answer)
+    provisional = degraded or trivial
+    # The opening request carries no answer and no previous question
+    opening = not (user_answer or "").strip() and not last_question
+
+    # Score the answer against earlier answers (this session and others)
+    similarity = {}
+    sim_index = None
+    answer_sig = None
+    if SIMILARITY_ENABLED:
+        sim_index = session_index(session_id, shared_similarity)
+        if last_question:
+            sim_index.questions.add(last_question)
+        if not trivial:
+            answer_similarity, answer_sig = score_answer(session_id, sim_index, user_answer)
+            similarity.update(answer_similarity)
+
+    if provisional:
+        interviewer_reply = _local_reply(role, user_answer, last_question)
+        quick_feedback = local_quick_feedback(user_answer, role)
     else:
-        interviewer_reply = parsed.get("interviewer_reply") or parsed.get("agent_prompt") or ""
-        quick_feedback = parsed.get("quick_feedback") or parsed
+        # 1) Assemble the interview prompt: static instructions -> role ->
+        # history -> this answer, so the stable prefix can be cached
+        turn_prompt = assemble_interview_turn(
+            role=role,
+            question_context=question_context,
+            last_question=last_question,
+            user_answer=user_answer,
+            history=history
+        )
+
+        # 2) Call LLM for structured micro-feedback + interviewer reply
+        raw = await call_gemini_chat(turn_prompt.body, call_site="structured_feedback",
+                                     cache_prefix=turn_prompt.cache_prefix)
+        parsed = _extract_json_from_text(raw)
+
+        # If parsing failed, attempt to salvage by asking LLM to reformat
+        if parsed is None:
+            # Ask LLM to convert its previous answer to JSON only
+            salvage_prompt = f"Please reformat the following into valid JSON with keys interviewer_reply and quick_feedback only:\n\n{raw}\n\nJSON:"
+            try:
+                salvage_raw = await call_gemini_chat(salvage_prompt, call_site="salvage")
+            except SchedulerRejected:
+                # shed under load: fall through to the local scorer
+                salvage_raw = None
+            parsed2 = _extract_json_from_text(salvage_raw)
+            parsed = parsed2 if parsed2 is not None else None
+
+        if parsed is None:
+            # Fallback: provisional local scores so DIPE still has a signal
+            provisional = True
+            interviewer_reply = _local_reply(role, user_answer, last_question)
+            quick_feedback = local_quick_feedback(user_answer, role)
+        else:
+            interviewer_reply = parsed.get("interviewer_reply") or parsed.get("agent_prompt") or ""
+            quick_feedback = parsed.get("quick_feedback") or parsed
+
+    record_stage("scoring", time.perf_counter() - stage_started)
 
     # 3) Use DIPE to pick next question type
     next_type = choose_next_type(quick_feedback, turn_count)
 
-    # 4) Generate a next question string (call LLM)
-    qgen_prompt = QUESTION_GEN_INSTRUCTION + f"\nUser Answer: {user_answer}\nContext: {question_context or ''}\nType: {next_type}\nRole: {role}"
-
-    try:
-        next_q_raw = await call_gemini_chat(qgen_prompt)
-        # the question should be a single sentence; strip extra whitespace
-        next_question = (next_q_raw or "").strip().strip('"').strip("'")
-        # If LLM returned JSON or paragraphs, extract first line
-        if "\n" in next_question:
-            next_question = next_question.splitlines()[0].strip()
-        # ensure it ends with '?'
-        if not next_question.endswith('?'):
-            next_question = next_question.rstrip('.') + '?'
-    except Exception as e:
-        next_question = "Could you expand on that a bit more?"
+    # 4) Generate a next question string: reuse the speculative pre-generation
+    # for this route if one exists, otherwise call the LLM (or the local bank
+    # when degraded)
+    stage_started = time.perf_counter()
+    next_question = None
+    speculative_hit = False
+    if degraded:
+        next_question = local_question(next_type, role)
+    else:
+        next_question = await take_speculated_question(session_id, turn_count, next_type,
+                                                       shared=shared_session)
+        speculative_hit = next_question is not None
+    if next_question is None:
+        try:
+            next_question = await generate_question(next_type, role, user_answer, question_context)
+        except Exception as e:
+            next_question = local_question(next_type, role)
+    # Never re-ask (a close paraphrase of) a question from earlier turns
+    if sim_index is not None:
+        next_question, question_similarity = await _avoid_repeated_question(
+            sim_index, next_question, next_type, role, user_answer, question_context, degraded)
+        similarity.update(question_similarity)
+    # The client shows interviewer_reply, so the welcome must carry the first question
+    if opening:
+        interviewer_reply = f"{interviewer_reply} {next_question}"
+    record_stage("question", time.perf_counter() - stage_started)
 
     # 5) Reflection (async) - do not block too long (fire and await short timeout)
+    stage_started = time.perf_counter()
     reflection_signal = {}
-    try:
-        # run reflection with modest timeout
-        refl_task = reflect_and_recommend(history + [{"role":"assistant","text":interviewer_reply},{"role":"user","text":user_answer}], last_n=6)
-        # await the task (it is async) but protect with timeout
-        reflection_signal = await asyncio.wait_for(refl_task, timeout=10.0)
-    except asyncio.TimeoutError:
-        reflection_signal = {"raw": "reflection timeout"}
-    except Exception as e:
-        reflection_signal = {"error": str(e)}
+    if degraded:
+        reflection_signal = {"raw": "reflection skipped (degraded mode)"}
+    elif trivial:
+        reflection_signal = {"raw": "reflection skipped (trivial answer)"}
+    else:
+        try:
+            # run reflection with modest timeout
+            refl_task = reflect_and_recommend(history + [{"role":"assistant","text":interviewer_reply},{"role":"user","text":user_answer}], last_n=6)
+            # await the task (it is async) but protect with timeout
+            reflection_signal = await asyncio.wait_for(refl_task, timeout=10.0)
+        except asyncio.TimeoutError:
+            reflection_signal = {"raw": "reflection timeout"}
+        except SchedulerRejected:
+            reflection_signal = {"raw": "reflection skipped (overloaded)"}
+        except Exception as e:
+            reflection_signal = {"error": str(e)}
+    record_stage("reflection", time.perf_counter() - stage_started)
 
     # 6) Build DIPE state reason (simple)
     dipe_state = {
         "route": next_type,
-        "reason": f"DIPE chose {next_type} based on quick_feedback and turn_count={turn_count}"
+        "reason": f"DIPE chose {next_type} based on quick_feedback and turn_count={turn_count}",
+        "speculative_hit": speculative_hit,
+        "scoring": "local" if provisional else "llm",
+        "degraded": degraded
     }
 
-    # 7) Build final structured response
+    # 7) Pre-generate likely next-turn questions while the candidate answers.
+    # The client sends the opening request and the first answer with the same
+    # turn_count, so questions pre-generated on the opening are for this turn.
+    if next_type != "wrap_up" and not degraded:
+        next_turn = turn_count if opening else turn_count + 1
+        schedule_speculation(
+            session_id,
+            next_turn,
+            likely_next_types(quick_feedback, next_turn),
+            lambda qtype: generate_question(qtype, role, user_answer, question_context,
+                                            call_site="speculation")
+        )
+
+    # 8) Build final structured response
     resp = {
         "interviewer_reply": interviewer_reply,
         "quick_feedback": quick_feedback,
+        "provisional": provisional,
         "next_question": next_question,
         "question_type": next_type,
         "dipe_state": dipe_state,
-        "reflection_signal": reflection_signal
+        "reflection_signal": reflection_signal,
+        "similarity": similarity
     }
+    # Index this turn only now that it has succeeded
+    if sim_index is not None:
+        commit_turn(session_id, sim_index, user_answer, answer_sig, next_question, writes)
+    record_stage("total", time.perf_counter() - turn_started)
 
     return resp
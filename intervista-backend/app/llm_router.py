@@ -0,0 +1,486 @@
+# app/llm_router.py
+"""
+Tiered model routing and multi-key load balancing for Gemini calls.
+
+Every LLM call names its call site; the call site maps to a model tier and
+the tier to a model:
+
+    call site            default tier     env override
+    structured_feedback  standard         LLM_TIER_STRUCTURED_FEEDBACK
+    salvage              fast             LLM_TIER_SALVAGE
+    question_gen         fast             LLM_TIER_QUESTION_GEN
+    speculation          fast             LLM_TIER_SPECULATION
+    reflection           fast             LLM_TIER_REFLECTION
+    final_report         premium          LLM_TIER_FINAL_REPORT
+
+    tier      default model            env override
+    fast      gemini-2.5-flash-lite    LLM_MODEL_FAST
+    standard  gemini-2.5-flash         LLM_MODEL_STANDARD
+    premium   gemini-2.5-pro           LLM_MODEL_PREMIUM
+
+Requests are spread over a pool of API keys (GOOGLE_API_KEYS, comma-separated,
+falling back to GOOGLE_API_KEY). An entry may pin an endpoint as
+"key@host". Each key has a token bucket of LLM_KEY_RPM requests per minute
+(divided across LLM_WORKERS processes) and the least-loaded key with a token
+available is picked for every call.
+
+Before a key is picked, the call waits for a slot from the priority
+scheduler (see scheduler.py); SchedulerRejected propagates to the caller.
+When every bucket is empty, callers wait for tokens in priority order too
+(interactive first, then FIFO within a class), and the expected token wait
+is reported to the scheduler so its deadline check accounts for it.
+
+Prompts may be split into a stable `cache_prefix` and a per-call body (see
+prompt_assembly). The prefix is always sent first, so the provider's implicit
+prefix caching applies; once it reaches PROMPT_CACHE_MIN_TOKENS it is also
+pinned as explicit cached content per key and model (refreshed before its
+PROMPT_CACHE_TTL_SECONDS expiry) and only the body is sent. The cached
+content is created in the background; calls send the prefix inline until it
+is ready, so no interactive call waits on cache creation. The current
+prefixes (system + role, roughly 40-180 tokens) are all below the default
+minimum, so explicit caching is inactive unless prompts grow or the minimum
+is lowered; implicit caching still applies.
+
+Per-tier latency, token usage (including cached tokens) and estimated cost
+are kept in memory and returned by get_router_metrics().
+
+Every call is reported to traffic_capture (a no-op unless capture is on).
+set_llm_transport() swaps the provider for another coroutine, which is how
+captured traffic is replayed offline.
+"""
+
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from collections import deque
+import asyncio
+import datetime
+import hashlib
+import heapq
+import itertools
+import os
+import time
+
+import google.generativeai as genai
+from google.ai import generativelanguage as glm
+
+from .degraded_mode import record_llm_failure, record_llm_success
+from .scheduler import PRIORITY_CLASSES, priority_for, scheduler
+from .prompt_assembly import estimate_tokens
+from .traffic_capture import record_llm_call
+
+CALL_SITE_TIERS = {
+    "structured_feedback": "standard",
+    "salvage": "fast",
+    "question_gen": "fast",
+    "speculation": "fast",
+    "reflection": "fast",
+    "final_report": "premium",
+    "default": "standard",
+}
+
+TIER_MODELS = {
+    "fast": "gemini-2.5-flash-lite",
+    "standard": "gemini-2.5-flash",
+    "premium": "gemini-2.5-pro",
+}
+
+# USD per 1M tokens (input, output); override with LLM_PRICE_<TIER>="in,out"
+TIER_PRICES = {
+    "fast": (0.10, 0.40),
+    "standard": (0.30, 2.50),
+    "premium": (1.25, 10.00),
+}
+
+LLM_WORKERS = max(int(os.getenv("LLM_WORKERS", "1")), 1)
+LLM_KEY_RPM = float(os.getenv("LLM_KEY_RPM", "60")) / LLM_WORKERS
+LLM_KEY_BURST = float(os.getenv("LLM_KEY_BURST", "5"))
+
+PROMPT_CACHE_ENABLED = os.getenv("PROMPT_CACHE_ENABLED", "1") != "0"
+# explicit caches below the provider minimum are rejected, so don't try
+PROMPT_CACHE_MIN_TOKENS = int(os.getenv("PROMPT_CACHE_MIN_TOKENS", "1024"))
+PROMPT_CACHE_TTL_SECONDS = int(os.getenv("PROMPT_CACHE_TTL_SECONDS", "3600"))
+# share of the input price charged for cached prompt tokens
+CACHED_INPUT_PRICE_RATIO = 0.25
+
+_LATENCY_WINDOW = 200
+
+
+def tier_for(call_site: str) -> str:
+    default = CALL_SITE_TIERS.get(call_site, CALL_SITE_TIERS["default"])
+    tier = os.getenv(f"LLM_TIER_{call_site.upper()}", default)
+    return tier if tier in TIER_MODELS else default
+
+
+def model_for(tier: str) -> str:
+    return os.getenv(f"LLM_MODEL_{tier.upper()}", TIER_MODELS[tier])
+
+
+def _price_for(tier: str) -> Tuple[float, float]:
+    raw = os.getenv(f"LLM_PRICE_{tier.upper()}")
+    if raw:
+        try:
+            inp, out = raw.split(",")
+            return float(inp), float(out)
+        except ValueError:
+            pass
+    return TIER_PRICES[tier]
+
+
+class _TokenBucket:
+    """Classic token bucket: `rate` tokens per second up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = max(capacity, 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def available(self) -> float:
+        self._refill()
+        return self.tokens
+
+    def take(self) -> None:
+        self._refill()
+        self.tokens -= 1
+
+    def wait_time(self) -> float:
+        self._refill()
+        if self.tokens >= 1 or self.rate <= 0:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class _KeySlot:
+    """One API key (and optional endpoint) with its own clients and limits."""
+
+    def __init__(self, api_key: str, endpoint: Optional[str] = None):
+        self.api_key = api_key
+        self.endpoint = endpoint
+        self.bucket = _TokenBucket(LLM_KEY_RPM / 60.0, LLM_KEY_BURST)
+        self.inflight = 0
+        self.calls = 0
+        self.errors = 0
+        self.throttled = 0
+        self._client = None
+        self._cache_client = None
+        self._models: Dict[str, genai.GenerativeModel] = {}
+        # (model, prefix hash) -> (valid_until, model bound to cached content or None)
+        self._cached: Dict[Tuple[str, str], Tuple[float, Optional[genai.GenerativeModel]]] = {}
+        self._creating: Dict[Tuple[str, str], asyncio.Task] = {}
+
+    @property
+    def label(self) -> str:
+        suffix = f"@{self.endpoint}" if self.endpoint else ""
+        return f"...{self.api_key[-4:]}{suffix}"
+
+    def _client_options(self) -> Dict[str, str]:
+        options = {"api_key": self.api_key}
+        if self.endpoint:
+            options["api_endpoint"] = self.endpoint
+        return options
+
+    def model(self, model_name: str) -> genai.GenerativeModel:
+        m = self._models.get(model_name)
+        if m is None:
+            if self._client is None:
+                self._client = glm.GenerativeServiceAsyncClient(client_options=self._client_options())
+            m = genai.GenerativeModel(model_name)
+            # bind the model to this key's client instead of the global default
+            m._async_client = self._client
+            self._models[model_name] = m
+        return m
+
+    def cached_model(self, model_name: str, prefix: str) -> Optional[genai.GenerativeModel]:
+        """
+        Model whose context is `prefix` pinned as explicit cached content on
+        this key, or None when it is unavailable (not created yet, or creation
+        failed recently). A missing or expired cache is created in the
+        background, so the caller never waits for it.
+        """
+        key = (model_name, hashlib.sha1(prefix.encode("utf-8")).hexdigest())
+        entry = self._cached.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            return entry[1]
+        if key not in self._creating:
+            task = asyncio.create_task(self._create_cache(key, model_name, prefix))
+            self._creating[key] = task
+            task.add_done_callback(lambda t: self._creating.pop(key, None))
+        return None
+
+    async def _create_cache(self, key: Tuple[str, str], model_name: str, prefix: str) -> None:
+        now = time.monotonic()
+        try:
+            if self._cache_client is None:
+                self._cache_client = glm.CacheServiceAsyncClient(client_options=self._client_options())
+            cached = await self._cache_client.create_cached_content(
+                cached_content=glm.CachedContent(
+                    model=f"models/{model_name}",
+                    system_instruction=glm.Content(parts=[glm.Part(text=prefix)]),
+                    ttl=datetime.timedelta(seconds=PROMPT_CACHE_TTL_SECONDS),
+                )
+            )
+            m = genai.GenerativeModel(model_name)
+            m._cached_content = cached.name
+            m._async_client = self.model(model_name)._async_client
+            # refresh a minute before the provider expires it
+            self._cached[key] = (now + max(PROMPT_CACHE_TTL_SECONDS - 60, 1), m)
+        except Exception as e:
+            print(f"Prompt cache creation failed: {str(e)}")
+            # back off and send the prefix inline for a while
+            self._cached[key] = (now + 300, None)
+
+
+def _load_key_pool() -> List[_KeySlot]:
+    raw = os.getenv("GOOGLE_API_KEYS") or os.getenv("GOOGLE_API_KEY") or ""
+    slots = []
+    for entry in raw.split(","):
+        entry = entry.strip()
+        if not entry:
+            continue
+        key, _, endpoint = entry.partition("@")
+        slots.append(_KeySlot(key, endpoint or None))
+    return slots
+
+
+_pool: List[_KeySlot] = []
+# Calls waiting for a rate-limit token: heap of (class rank, arrival, future)
+_token_waiters: List[Tuple[int, int, asyncio.Future]] = []
+_waiter_seq = itertools.count()
+_dispatcher: Optional[asyncio.Task] = None
+
+
+def _ensure_pool() -> List[_KeySlot]:
+    global _pool
+    if not _pool:
+        _pool = _load_key_pool()
+        if not _pool:
+            raise ValueError("GOOGLE_API_KEY not found in .env")
+    return _pool
+
+
+def _take_ready(pool: List[_KeySlot]) -> Optional[_KeySlot]:
+    """Take a token from the least-loaded key that has one, if any."""
+    ready = [s for s in pool if s.bucket.available() >= 1]
+    if not ready:
+        return None
+    slot = min(ready, key=lambda s: (s.inflight, -s.bucket.tokens))
+    slot.bucket.take()
+    slot.inflight += 1
+    return slot
+
+
+def _class_rank(priority: str) -> int:
+    return PRIORITY_CLASSES.index(priority) if priority in PRIORITY_CLASSES else 0
+
+
+async def _dispatch_tokens(pool: List[_KeySlot]) -> None:
+    """Hand refilled tokens to waiting calls, highest priority class first."""
+    while _token_waiters:
+        if _token_waiters[0][2].done():
+            # cancelled while waiting
+            heapq.heappop(_token_waiters)
+            continue
+        slot = _take_ready(pool)
+        if slot is None:
+            await asyncio.sleep(min(s.bucket.wait_time() for s in pool))
+            continue
+        _, _, fut = heapq.heappop(_token_waiters)
+        fut.set_result(slot)
+
+
+async def _acquire_slot(priority: str = "interactive") -> _KeySlot:
+    """
+    Pick the least-loaded key that has a rate-limit token. When every bucket
+    is empty (or other calls are already waiting), queue for the next token
+    by priority class.
+    """
+    global _dispatcher
+    pool = _ensure_pool()
+    if not _token_waiters:
+        slot = _take_ready(pool)
+        if slot is not None:
+            return slot
+
+    fut = asyncio.get_running_loop().create_future()
+    heapq.heappush(_token_waiters, (_class_rank(priority), next(_waiter_seq), fut))
+    if _dispatcher is None or _dispatcher.done():
+        _dispatcher = asyncio.create_task(_dispatch_tokens(pool))
+    try:
+        slot = await fut
+    except asyncio.CancelledError:
+        if fut.done() and not fut.cancelled():
+            # a token was handed over just as we were cancelled
+            fut.result().inflight -= 1
+        raise
+    slot.throttled += 1
+    return slot
+
+
+def estimated_token_wait(priority: str) -> float:
+    """
+    Rough wait for a rate-limit token for a newcomer of `priority`: calls of
+    the same or a higher class already queued, served at the pool's combined
+    refill rate.
+    """
+    if not _pool:
+        return 0.0
+    rank = _class_rank(priority)
+    ahead = sum(1 for r, _, fut in _token_waiters if r <= rank and not fut.done())
+    available = sum(int(s.bucket.available()) for s in _pool)
+    rate = sum(s.bucket.rate for s in _pool)
+    needed = ahead + 1 - available
+    if needed <= 0:
+        return 0.0
+    return needed / rate if rate > 0 else float("inf")
+
+
+scheduler.capacity_wait = estimated_token_wait
+
+
+class _TierStats:
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.output_tokens = 0
+        self.cost_usd = 0.0
+        self.latencies = deque(maxlen=_LATENCY_WINDOW)
+
+    def snapshot(self) -> Dict[str, float]:
+        lat = sorted(self.latencies)
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "prompt_tokens": self.prompt_tokens,
+            "cached_tokens": self.cached_tokens,
+            "output_tokens": self.output_tokens,
+            "cost_usd": round(self.cost_usd, 6),
+            "latency_avg_ms": round(sum(lat) / len(lat) * 1000, 1) if lat else 0.0,
+            "latency_p95_ms": round(lat[int(0.95 * (len(lat) - 1))] * 1000, 1) if lat else 0.0,
+        }
+
+
+_tier_stats: Dict[str, _TierStats] = {tier: _TierStats() for tier in TIER_MODELS}
+
+
+def _usage(response, prompt: str, text: str) -> Tuple[int, int, int]:
+    meta = getattr(response, "usage_metadata", None)
+    prompt_tokens = getattr(meta, "prompt_token_count", 0) or 0
+    cached_tokens = getattr(meta, "cached_content_token_count", 0) or 0
+    output_tokens = getattr(meta, "candidates_token_count", 0) or 0
+    if not prompt_tokens:
+        # rough estimate when the provider does not report usage
+        prompt_tokens = estimate_tokens(prompt)
+    if not output_tokens:
+        output_tokens = estimate_tokens(text)
+    return prompt_tokens, cached_tokens, output_tokens
+
+
+async def routed_generate(prompt: str, call_site: str = "default",
+                          cache_prefix: Optional[str] = None) -> str:
+    """
+    Generate text for `prompt` on the model tier configured for `call_site`,
+    using the least-loaded API key. Raises on provider errors and
+    SchedulerRejected when admission control refuses the call.
+
+    With `cache_prefix`, the request is cache_prefix followed by prompt; the
+    prefix is served from explicit cached content when it is large enough
+    and that content has already been created.
+    """
+    tier = tier_for(call_site)
+    model_name = model_for(tier)
+    stats = _tier_stats[tier]
+    use_explicit_cache = (
+        PROMPT_CACHE_ENABLED and cache_prefix
+        and estimate_tokens(cache_prefix) >= PROMPT_CACHE_MIN_TOKENS
+    )
+
+    async with scheduler.slot(priority_for(call_site)):
+        if _transport is not None:
+            return await _call_transport(call_site, prompt)
+
+        slot = await _acquire_slot(priority_for(call_site))
+        started = time.perf_counter()
+        try:
+            model = slot.cached_model(model_name, cache_prefix) if use_explicit_cache else None
+            if model is not None:
+                contents = prompt
+            else:
+                model = slot.model(model_name)
+                contents = f"{cache_prefix}\n\n{prompt}" if cache_prefix else prompt
+            response = await model.generate_content_async(contents)
+            text = response.text.strip()
+        except Exception as e:
+            slot.errors += 1
+            stats.errors += 1
+            record_llm_failure()
+            record_llm_call(call_site, prompt, None, time.perf_counter() - started, str(e))
+            raise
+        finally:
+            slot.inflight -= 1
+            slot.calls += 1
+            stats.calls += 1
+            stats.latencies.append(time.perf_counter() - started)
+
+    record_llm_success()
+    record_llm_call(call_site, prompt, text, stats.latencies[-1])
+    full_prompt = f"{cache_prefix}\n\n{prompt}" if cache_prefix else prompt
+    prompt_tokens, cached_tokens, output_tokens = _usage(response, full_prompt, text)
+    price_in, price_out = _price_for(tier)
+    stats.prompt_tokens += prompt_tokens
+    stats.cached_tokens += cached_tokens
+    stats.output_tokens += output_tokens
+    stats.cost_usd += (
+        (prompt_tokens - cached_tokens) * price_in
+        + cached_tokens * price_in * CACHED_INPUT_PRICE_RATIO
+        + output_tokens * price_out
+    ) / 1_000_000
+    return text
+
+
+_transport: Optional[Callable[[str, str], Awaitable[str]]] = None
+
+
+def set_llm_transport(transport: Optional[Callable[[str, str], Awaitable[str]]]) -> None:
+    """
+    Route all calls to `transport(call_site, prompt)` instead of Gemini
+    (None restores the provider). Scheduling still applies.
+    """
+    global _transport
+    _transport = transport
+
+
+async def _call_transport(call_site: str, prompt: str) -> str:
+    started = time.perf_counter()
+    try:
+        text = await _transport(call_site, prompt)
+    except Exception as e:
+        record_llm_call(call_site, prompt, None, time.perf_counter() - started, str(e))
+        raise
+    record_llm_call(call_site, prompt, text, time.perf_counter() - started)
+    return text
+
+
+def get_router_metrics() -> Dict[str, Dict]:
+    return {
+        "tiers": {
+            tier: {"model": model_for(tier), **stats.snapshot()}
+            for tier, stats in _tier_stats.items()
+        },
+        "keys": [
+            {
+                "key": s.label,
+                "inflight": s.inflight,
+                "calls": s.calls,
+                "errors": s.errors,
+                "throttled": s.throttled,
+                "tokens": round(s.bucket.available(), 2),
+            }
+            for s in _pool
+        ],
+    }
@@ -0,0 +1,211 @@
+# app/local_scorer.py
+"""
+Local fast-path scorer.
+
+Produces provisional quick_feedback (same shape as the LLM's) from cheap text
+features, without any network call:
+ - length (words, sentences)
+ - role keyword coverage
+ - structure markers (STAR steps, numbers/metrics, reasoning connectives,
+   first-person ownership)
+
+The feature vector is mapped to competency scores with a fixed weight matrix,
+so scoring an answer is a handful of NumPy operations. Results are flagged
+with "provisional": True so callers and the UI can tell them apart from LLM
+feedback.
+
+Also holds a small local question bank used when the LLM is unavailable.
+"""
+
+from typing import Dict, List
+import random
+import re
+
+import numpy as np
+
+# Answers with fewer words than this are scored locally instead of by the LLM
+LOCAL_SCORER_MIN_WORDS = 5
+
+COMPETENCIES = ["communication", "technical", "problem_solving", "behavioral"]
+
+ROLE_KEYWORDS = {
+    "software engineer": [
+        "api", "architecture", "cache", "caching", "database", "sql", "latency",
+        "scalability", "scale", "distributed", "microservice", "microservices",
+        "python", "java", "algorithm", "complexity", "test", "tests", "testing",
+        "deploy", "deployment", "queue", "thread", "async", "memory", "performance",
+        "kubernetes", "docker", "cloud", "design", "refactor", "debug", "bug",
+    ],
+    "data analyst": [
+        "sql", "query", "dashboard", "excel", "python", "pandas", "regression",
+        "statistics", "statistical", "metric", "metrics", "kpi", "visualization",
+        "tableau", "data", "dataset", "cleaning", "correlation", "hypothesis",
+        "a/b", "experiment", "forecast", "trend", "report", "insight", "insights",
+    ],
+    "sales associate": [
+        "customer", "customers", "client", "clients", "quota", "pipeline", "lead",
+        "leads", "prospect", "closing", "close", "deal", "deals", "negotiate",
+        "negotiation", "revenue", "target", "crm", "upsell", "objection", "relationship",
+    ],
+    "retail associate": [
+        "customer", "customers", "store", "inventory", "stock", "register", "cash",
+        "shelf", "display", "sales", "service", "return", "returns", "complaint",
+        "shift", "team", "merchandise", "checkout", "product", "products",
+    ],
+}
+
+GENERIC_KEYWORDS = [
+    "team", "project", "goal", "deadline", "stakeholder", "stakeholders",
+    "challenge", "impact", "learned", "improved", "reduced", "increased",
+]
+
+STAR_MARKERS = ["situation", "task", "action", "result", "results", "outcome"]
+REASONING_MARKERS = [
+    "because", "therefore", "so", "since", "first", "then", "finally", "however",
+    "tradeoff", "trade-off", "instead", "alternatively", "approach", "option",
+]
+OWNERSHIP_MARKERS = ["i", "my", "me", "we", "our"]
+
+# feature order:
+#   0 words (saturating), 1 sentences (saturating), 2 role keyword coverage,
+#   3 STAR coverage, 4 numbers/metrics, 5 reasoning markers, 6 ownership
+_WEIGHTS = np.array([
+    # words  sent  role  star  nums  reas  own
+    [4.0,   2.0,  0.5,  0.5,  0.0,  1.5,  0.5],   # communication
+    [1.5,   0.0,  6.0,  0.0,  1.0,  0.5,  0.0],   # technical
+    [1.5,   0.5,  1.5,  1.0,  1.0,  3.5,  0.0],   # problem_solving
+    [1.5,   0.5,  0.0,  4.0,  0.5,  0.5,  2.0],   # behavioral
+], dtype=np.float32)
+_BIAS = np.array([1.5, 1.0, 1.0, 1.0], dtype=np.float32)
+
+_TOKEN_RE = re.compile(r"[a-z0-9/+#\-]+")
+_SENTENCE_RE = re.compile(r"[.!?]+")
+_NUMBER_RE = re.compile(r"\d")
+
+# One sorted vocabulary per role with a bitmask per word, so every token of an
+# answer is classified by a single np.searchsorted call
+_ROLE, _STAR, _REASONING, _OWNERSHIP = 1, 2, 4, 8
+
+
+def _build_vocabulary(role_words: List[str]):
+    flags: Dict[str, int] = {}
+    for group, bit in ((role_words, _ROLE), (STAR_MARKERS, _STAR),
+                       (REASONING_MARKERS, _REASONING), (OWNERSHIP_MARKERS, _OWNERSHIP)):
+        for w in group:
+            flags[w] = flags.get(w, 0) | bit
+    words = sorted(flags)
+    return np.array(words), np.array([flags[w] for w in words], dtype=np.uint8)
+
+
+_role_vocab = {role: _build_vocabulary(words + GENERIC_KEYWORDS)
+               for role, words in ROLE_KEYWORDS.items()}
+_generic_vocab = _build_vocabulary(GENERIC_KEYWORDS)
+
+
+def _role_vocabulary(role: str):
+    key = (role or "").strip().lower()
+    return _role_vocab.get(key, _generic_vocab)
+
+
+def is_trivial_answer(user_answer: str) -> bool:
+    """True for empty or very short answers that are not worth an LLM call."""
+    return len((user_answer or "").split()) < LOCAL_SCORER_MIN_WORDS
+
+
+def answer_features(user_answer: str, role: str = "") -> np.ndarray:
+    """Feature vector in [0, 1] for one answer (see _WEIGHTS for the order)."""
+    text = (user_answer or "").lower()
+    tokens = np.array(_TOKEN_RE.findall(text))
+    n = tokens.size
+    if n == 0:
+        return np.zeros(_WEIGHTS.shape[1], dtype=np.float32)
+
+    words, word_flags = _role_vocabulary(role)
+    idx = np.minimum(np.searchsorted(words, tokens), words.size - 1)
+    flags = np.where(words[idx] == tokens, word_flags[idx], 0)
+
+    sentences = max(len([s for s in _SENTENCE_RE.split(text) if s.strip()]), 1)
+    role_hits = np.unique(tokens[(flags & _ROLE) > 0]).size
+    star_hits = np.unique(tokens[(flags & _STAR) > 0]).size
+    numbers = len(_NUMBER_RE.findall(text))
+    reasoning = np.count_nonzero(flags & _REASONING)
+    ownership = np.count_nonzero(flags & _OWNERSHIP)
+
+    return np.array([
+        min(n / 120.0, 1.0),
+        min(sentences / 5.0, 1.0),
+        min(role_hits / 6.0, 1.0),
+        min(star_hits / 3.0, 1.0),
+        min(numbers / 2.0, 1.0),
+        min(reasoning / 4.0, 1.0),
+        min(ownership / 3.0, 1.0),
+    ], dtype=np.float32)
+
+
+def local_quick_feedback(user_answer: str, role: str = "") -> Dict:
+    """
+    Provisional quick_feedback in the same shape the LLM returns:
+    {score, strengths, improvements, competency_scores, provisional}
+    """
+    feats = answer_features(user_answer, role)
+    scores = np.clip(np.rint(_WEIGHTS @ feats + _BIAS), 0, 10).astype(int)
+    competency_scores = {k: int(v) for k, v in zip(COMPETENCIES, scores)}
+
+    strengths: List[str] = []
+    improvements: List[str] = []
+    if feats[2] >= 0.5:
+        strengths.append("Uses relevant domain terminology")
+    else:
+        improvements.append("Reference the concrete tools, techniques or terms you used")
+    if feats[4] > 0:
+        strengths.append("Quantifies impact with numbers")
+    else:
+        improvements.append("Add measurable results (numbers, percentages, timelines)")
+    if feats[3] >= 0.66:
+        strengths.append("Follows a clear situation-action-result structure")
+    elif feats[0] > 0:
+        improvements.append("Structure the answer as situation, action and result")
+    if feats[0] < 0.15:
+        improvements.append("Expand the answer with more detail")
+
+    return {
+        "score": int(round(float(scores.mean()))),
+        "strengths": strengths,
+        "improvements": improvements[:3],
+        "competency_scores": competency_scores,
+        "provisional": True,
+    }
+
+
+LOCAL_QUESTION_BANK = {
+    "technical": [
+        "Can you walk me through the technical design of a recent {role} project you worked on?",
+        "Which tools or technologies do you rely on most as a {role}, and why?",
+    ],
+    "behavioral": [
+        "Can you tell me about a time you disagreed with a teammate and how you resolved it?",
+        "How did you handle a situation where you had to meet a tight deadline?",
+    ],
+    "follow_up": [
+        "Could you expand on that with a specific example?",
+        "What was the outcome, and how did you measure it?",
+    ],
+    "problem_solving": [
+        "How would you approach a problem you have never seen before in your {role} work?",
+        "Can you describe a difficult problem you solved, step by step?",
+    ],
+    "wrap_up": [
+        "Is there anything else about your experience you would like to share before we finish?",
+    ],
+}
+
+
+def local_question_options(qtype: str, role: str = "") -> List[str]:
+    """All canned questions of the requested type."""
+    options = LOCAL_QUESTION_BANK.get(qtype) or LOCAL_QUESTION_BANK["follow_up"]
+    return [q.format(role=role or "candidate") for q in options]
+
+
+def local_question(qtype: str, role: str = "") -> str:
+    """Pick a canned question of the requested type (used when the LLM is unavailable)."""
+    return random.choice(local_question_options(qtype, role))
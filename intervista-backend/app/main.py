@@ -1,6 +1,7 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from app.endpoints import router as api_router
+from app.traffic_capture import close_capture
 from dotenv import load_dotenv
 from pathlib import Path
 import os
@@ -26,6 +27,11 @@ app.add_middleware(
 
 app.include_router(api_router, prefix="/api")
 
+@app.on_event("shutdown")
+async def shutdown():
+    # flush and close the traffic capture stream, if capture is on
+    await close_capture()
+
 @app.get("/health")
 async def health():
     return {"status": "ok"}
@@ -0,0 +1,151 @@
+# app/prompt_assembly.py
+"""
+Prompt assembly with a prefix-stable layout.
+
+Every prompt is built from the segments defined in prompts.py, always in the
+order
+
+    system -> role -> context -> history -> turn
+
+so all calls of one kind share the static system prefix, and all calls for
+the same role also share the role prefix. Per-candidate context (the client's
+question_context, e.g. years of experience) comes after it, so it does not
+split the prefix per candidate. Providers cache on exact prefixes: Gemini 2.5
+applies implicit caching automatically, and the router can additionally pin
+`cache_prefix` (system + role) as explicit cached content once it is large
+enough (see llm_router).
+
+Segment sizes are tallied per prompt kind and returned by get_prompt_metrics().
+"""
+
+from typing import Any, Dict, List, Optional, Tuple
+
+from .prompts import (
+    INTERVIEW_SYSTEM, QUESTION_GEN_SYSTEM, REFLECTION_SYSTEM, FEEDBACK_SYSTEM,
+    ROLE_TPL, CONTEXT_TPL, HISTORY_TPL, INTERVIEW_TURN_TPL, QUESTION_GEN_TURN_TPL,
+)
+
+SEGMENT_ORDER = ("system", "role", "context", "history", "turn")
+# segments that make up the cacheable prefix
+PREFIX_SEGMENTS = ("system", "role")
+
+_SEPARATOR = "\n\n"
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token for English text)."""
+    return (len(text) + 3) // 4
+
+
+class AssembledPrompt:
+    """An ordered set of named prompt segments."""
+
+    def __init__(self, kind: str, segments: List[Tuple[str, str]]):
+        self.kind = kind
+        self.segments = [(name, text.strip()) for name, text in segments if text and text.strip()]
+
+    def _join(self, names) -> str:
+        return _SEPARATOR.join(text for name, text in self.segments if name in names)
+
+    @property
+    def text(self) -> str:
+        """The full prompt, for callers that send it as one string."""
+        return _SEPARATOR.join(text for _, text in self.segments)
+
+    @property
+    def cache_prefix(self) -> str:
+        """Stable prefix (system + role) eligible for provider-side caching."""
+        return self._join(PREFIX_SEGMENTS)
+
+    @property
+    def body(self) -> str:
+        """Everything after the cacheable prefix."""
+        return self._join([n for n in SEGMENT_ORDER if n not in PREFIX_SEGMENTS])
+
+    def sizes(self) -> Dict[str, Dict[str, int]]:
+        return {
+            name: {"chars": len(text), "tokens_est": estimate_tokens(text)}
+            for name, text in self.segments
+        }
+
+
+_stats: Dict[str, Dict[str, Dict[str, int]]] = {}
+
+
+def _record(prompt: AssembledPrompt) -> AssembledPrompt:
+    kind_stats = _stats.setdefault(prompt.kind, {})
+    for name, size in prompt.sizes().items():
+        seg = kind_stats.setdefault(name, {"count": 0, "chars": 0, "tokens_est": 0})
+        seg["count"] += 1
+        seg["chars"] += size["chars"]
+        seg["tokens_est"] += size["tokens_est"]
+    return prompt
+
+
+def _role(role: str) -> str:
+    return ROLE_TPL.render(role=role or "")
+
+
+def _context(question_context: str) -> str:
+    return CONTEXT_TPL.render(question_context=question_context) if question_context else ""
+
+
+def _history(history: Optional[List[Dict[str, Any]]]) -> str:
+    return HISTORY_TPL.render(history=history) if history else ""
+
+
+def assemble_interview_turn(role: str, question_context: str, last_question: str,
+                            user_answer: str, history: List[Dict[str, Any]]) -> AssembledPrompt:
+    """Structured micro-feedback + interviewer reply for one turn."""
+    return _record(AssembledPrompt("interview_turn", [
+        ("system", INTERVIEW_SYSTEM),
+        ("role", _role(role)),
+        ("context", _context(question_context)),
+        ("history", _history(history)),
+        ("turn", INTERVIEW_TURN_TPL.render(last_question=last_question or "",
+                                           user_answer=user_answer or "")),
+    ]))
+
+
+def assemble_question_gen(qtype: str, role: str, user_answer: str,
+                          question_context: str = "", avoid: str = "") -> AssembledPrompt:
+    """One-sentence next question of a DIPE type, optionally steering away from `avoid`."""
+    return _record(AssembledPrompt("question_gen", [
+        ("system", QUESTION_GEN_SYSTEM),
+        ("role", _role(role)),
+        ("context", _context(question_context)),
+        ("turn", QUESTION_GEN_TURN_TPL.render(qtype=qtype, user_answer=user_answer or "",
+                                                   avoid=avoid or "")),
+    ]))
+
+
+def assemble_reflection(history: List[Dict[str, Any]]) -> AssembledPrompt:
+    """Reflection over the recent conversation."""
+    return _record(AssembledPrompt("reflection", [
+        ("system", REFLECTION_SYSTEM),
+        ("history", _history(history)),
+    ]))
+
+
+def assemble_final_report(role: str, history: List[Dict[str, Any]]) -> AssembledPrompt:
+    """Post-interview feedback report."""
+    return _record(AssembledPrompt("final_report", [
+        ("system", FEEDBACK_SYSTEM),
+        ("role", _role(role)),
+        ("history", _history(history)),
+    ]))
+
+
+def get_prompt_metrics() -> Dict[str, Dict[str, Dict[str, float]]]:
+    """Average size per segment, per prompt kind."""
+    out = {}
+    for kind, segments in _stats.items():
+        out[kind] = {
+            name: {
+                "count": seg["count"],
+                "avg_chars": round(seg["chars"] / seg["count"], 1),
+                "avg_tokens_est": round(seg["tokens_est"] / seg["count"], 1),
+            }
+            for name, seg in segments.items()
+        }
+    return out
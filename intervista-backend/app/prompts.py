@@ -1,58 +1,106 @@
-from jinja2 import Template
+# app/prompts.py
+"""
+Prompt text and templates.
 
-INTERVIEW_TPL = Template("""
-System: Act as a professional interviewer for role: {{ role }}.
+All templates are compiled once at import time from a single shared Jinja
+environment. Every prompt is laid out in the same segment order, from most to
+least stable, so consecutive calls share the longest possible prefix (which
+is what provider-side context caching keys on):
+
+    system  - static instructions, identical for every call of that kind
+    role    - the role being interviewed for
+    context - per-candidate context (e.g. years of experience)
+    history - conversation so far
+    turn    - the current answer / question type
+
+See prompt_assembly.py for how the segments are put together.
+"""
+
+from jinja2 import Environment
+
+PROMPT_ENV = Environment(
+    autoescape=False,
+    trim_blocks=True,
+    lstrip_blocks=True,
+    keep_trailing_newline=False,
+    auto_reload=False,
+)
+
+# ---------------------------
+# Static system prefixes (no template variables)
+# ---------------------------
+INTERVIEW_SYSTEM = """
+You are a professional interviewer. You MUST return JSON only (no surrounding explanation).
 Task:
 1) Based on the candidate's answer produce interviewer_reply (1-2 sentences, either follow-up question or corrective hint).
-2) Provide quick_feedback JSON:
-{
-  "score": integer 0-10,
-  "strengths": [...],
-  "improvements": [...],
-  "competency_scores": {
-    "communication": 0-10,
-    "technical": 0-10,
-    "problem_solving": 0-10,
-    "behavioral": 0-10
-  }
+2) Provide quick_feedback.
+Return an object with the following keys:
+- interviewer_reply: string (1-2 sentence follow-up question or hint)
+- quick_feedback: {
+    "score": integer 0-10,
+    "strengths": [string],
+    "improvements": [string],
+    "competency_scores": {
+        "communication": 0-10,
+        "technical": 0-10,
+        "problem_solving": 0-10,
+        "behavioral": 0-10
+    }
 }
 Output JSON only with keys: interviewer_reply, quick_feedback.
+""".strip()
 
-Context:
-{{ question_context }}
+QUESTION_GEN_SYSTEM = """
+You are an interviewer. Return a interview question (one sentence) of the requested type.
+Return only the question text.
+""".strip()
 
-Last question: {{ last_question }}
-User answer: {{ user_answer }}
+REFLECTION_SYSTEM = """
+You are an interview reflection engine. Given the recent conversation history, produce JSON ONLY with keys:
+- summary: a 1-2 sentence high-level summary of candidate performance.
+- adjustments: a list (max 2) of adjustments to the interview path (brief strings).
+- recommended_next_questions: list of objects {"type": "...", "question": "..."} (max 3).
+Return only valid JSON.
+""".strip()
 
-Conversation history:
-{% for h in history %}
-{{ h.from }}: {{ h.text }}
-{% endfor %}
-""".strip())
-
-FEEDBACK_TPL = Template("""
-System: Act as an expert interviewer and coach for role: {{ role }}.
+FEEDBACK_SYSTEM = """
+You are an expert interviewer and coach.
 Task: Using the conversation history below, produce JSON with keys:
 - summary: 2-3 sentence summary
 - scores: {communication, technical, problem_solving, behavioral} (0-10)
 - improvements: 2 actionable improvements per competency
 - exemplar: one rewritten exemplary answer (choose best candidate answer)
 - resources: list of 3 resources {title, url}
+""".strip()
+
+# ---------------------------
+# Per-role / per-session / per-turn segments
+# ---------------------------
+ROLE_TPL = PROMPT_ENV.from_string("""
+Role: {{ role }}
+""".strip())
+
+CONTEXT_TPL = PROMPT_ENV.from_string("""
+Context:
+{{ question_context }}
+""".strip())
 
+HISTORY_TPL = PROMPT_ENV.from_string("""
 Conversation history:
 {% for h in history %}
-{{ h.from }}: {{ h.text }}
+{{ h.get('from') or h.get('role', '') }}: {{ h.get('text', '') }}
 {% endfor %}
 """.strip())
 
-def render_interview_prompt(role, question_context, last_question, user_answer, history):
-    return INTERVIEW_TPL.render(
-        role=role,
-        question_context=question_context or "",
-        last_question=last_question or "",
-        user_answer=user_answer or "",
-        history=history or []
-    )
-
-def render_feedback_prompt(role, history):
-    return FEEDBACK_TPL.render(role=role, history=history or [])
+INTERVIEW_TURN_TPL = PROMPT_ENV.from_string("""
+Last question: {{ last_question }}
+User answer: {{ user_answer }}
+""".strip())
+
+QUESTION_GEN_TURN_TPL = PROMPT_ENV.from_string("""
+Type: {{ qtype }}
+User Answer: {{ user_answer }}
+{% if avoid %}
+Already asked (ask something clearly different): {{ avoid }}
+{% endif %}
+""".strip())
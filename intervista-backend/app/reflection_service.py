@@ -3,36 +3,14 @@
 Reflection chain: ask the LLM to analyze recent turns and return
 structured recommendations to improve the interview path.
 
-This module uses your existing call_gemini_chat function.
+This module uses your existing call_gemini_chat function; the prompt is
+built by prompt_assembly.
 """
 
 from typing import List, Dict, Any
 import json
 from .utils import call_gemini_chat
-
-REFLECTION_PROMPT = """
-You are an interview reflection engine. Given the recent conversation history, produce JSON ONLY with keys:
-- summary: a 1-2 sentence high-level summary of candidate performance.
-- adjustments: a list (max 2) of adjustments to the interview path (brief strings).
-- recommended_next_questions: list of objects {"type": "...", "question": "..."} (max 3).
-
-History:
-{history_text}
-
-Return only valid JSON.
-"""
-
-def _render_history(history: List[Dict[str, str]]) -> str:
-    """
-    Accepts history as list of {"role": "assistant"/"user", "text": "..."}
-    Renders as plain text for the LLM.
-    """
-    lines = []
-    for h in history:
-        role = h.get("role", "assistant")
-        text = h.get("text", "")
-        lines.append(f"{role}: {text}")
-    return "\n".join(lines)
+from .prompt_assembly import assemble_reflection
 
 async def reflect_and_recommend(history: List[Dict[str, str]], last_n: int = 6) -> Dict[str, Any]:
     """
@@ -43,10 +21,10 @@ async def reflect_and_recommend(history: List[Dict[str, str]], last_n: int = 6)
         history = []
 
     hist_slice = history[-last_n:]
-    history_text = _render_history(hist_slice)
-    prompt = REFLECTION_PROMPT.format(history_text=history_text)
+    prompt = assemble_reflection(hist_slice)
 
-    raw = await call_gemini_chat(prompt)
+    raw = await call_gemini_chat(prompt.body, call_site="reflection",
+                                 cache_prefix=prompt.cache_prefix)
     # try to parse JSON from raw output
     parsed = _extract_json_or_none(raw)
     if parsed:
@@ -0,0 +1,228 @@
+# app/scheduler.py
+"""
+Priority scheduler and admission control for LLM work.
+
+Every upstream LLM call takes a slot from a single scheduler, limited to
+SCHED_MAX_CONCURRENCY concurrent calls. When all slots are busy, callers wait
+in a bounded queue for their priority class and freed slots go to the highest
+class first:
+
+    interactive > salvage > reflection > batch
+
+Admission control:
+ - a full class queue rejects new work for that class (SchedulerRejected)
+ - when more than SCHED_PRESSURE_QUEUE calls are waiting, queued work of a
+   lower class than the newcomer is shed, lowest class first
+ - interactive work whose estimated wait (queue plus rate-limit tokens, via
+   `capacity_wait`) plus service time would exceed TURN_DEADLINE_SECONDS is
+   rejected up front, so the endpoint can answer with a fast 503 and a
+   Retry-After hint instead of timing out
+ - rejecting interactive work also switches the service into degraded mode
+   for a short while (see degraded_mode), so the next turns are scored
+   locally instead of queueing behind the overload
+
+Queue time, shed and rejection counts per class are returned by
+get_scheduler_metrics().
+"""
+
+from typing import Callable, Dict, Optional
+from collections import deque
+from contextlib import asynccontextmanager
+import asyncio
+import math
+import os
+import time
+
+from .degraded_mode import record_overload
+
+PRIORITY_CLASSES = ["interactive", "salvage", "reflection", "batch"]
+
+CALL_SITE_CLASSES = {
+    "structured_feedback": "interactive",
+    "question_gen": "interactive",
+    "salvage": "salvage",
+    "reflection": "reflection",
+    "speculation": "batch",
+    "final_report": "batch",
+}
+
+SCHED_MAX_CONCURRENCY = int(os.getenv("SCHED_MAX_CONCURRENCY", "16"))
+SCHED_PRESSURE_QUEUE = int(os.getenv("SCHED_PRESSURE_QUEUE", "32"))
+TURN_DEADLINE_SECONDS = float(os.getenv("TURN_DEADLINE_SECONDS", "15"))
+
+QUEUE_LIMITS = {
+    "interactive": int(os.getenv("SCHED_QUEUE_INTERACTIVE", "64")),
+    "salvage": int(os.getenv("SCHED_QUEUE_SALVAGE", "32")),
+    "reflection": int(os.getenv("SCHED_QUEUE_REFLECTION", "16")),
+    "batch": int(os.getenv("SCHED_QUEUE_BATCH", "16")),
+}
+
+_WAIT_WINDOW = 200
+
+
+def priority_for(call_site: str) -> str:
+    return CALL_SITE_CLASSES.get(call_site, "interactive")
+
+
+class SchedulerRejected(Exception):
+    """Raised when work is refused or shed; retry_after is in whole seconds."""
+
+    def __init__(self, priority: str, reason: str, retry_after: int = 1):
+        super().__init__(f"{priority} LLM work rejected: {reason}")
+        self.priority = priority
+        self.reason = reason
+        self.retry_after = max(int(retry_after), 1)
+
+
+class _ClassStats:
+    def __init__(self):
+        self.admitted = 0
+        self.rejected = 0
+        self.shed = 0
+        self.waits = deque(maxlen=_WAIT_WINDOW)
+
+    def snapshot(self, queued: int) -> Dict[str, float]:
+        waits = sorted(self.waits)
+        return {
+            "queued": queued,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "shed": self.shed,
+            "queue_avg_ms": round(sum(waits) / len(waits) * 1000, 1) if waits else 0.0,
+            "queue_p95_ms": round(waits[int(0.95 * (len(waits) - 1))] * 1000, 1) if waits else 0.0,
+            "queue_max_ms": round(waits[-1] * 1000, 1) if waits else 0.0,
+        }
+
+
+class LLMScheduler:
+    """Slot pool with per-class bounded priority queues."""
+
+    def __init__(self, max_concurrency: int = SCHED_MAX_CONCURRENCY,
+                 queue_limits: Optional[Dict[str, int]] = None,
+                 turn_deadline: float = TURN_DEADLINE_SECONDS,
+                 pressure_queue: int = SCHED_PRESSURE_QUEUE):
+        self.max_concurrency = max(max_concurrency, 1)
+        self.queue_limits = dict(queue_limits or QUEUE_LIMITS)
+        self.turn_deadline = turn_deadline
+        self.pressure_queue = pressure_queue
+        self.active = 0
+        self._queues: Dict[str, deque] = {p: deque() for p in PRIORITY_CLASSES}
+        self._stats: Dict[str, _ClassStats] = {p: _ClassStats() for p in PRIORITY_CLASSES}
+        # EWMA of upstream call duration, seeded with a typical Gemini latency
+        self._service_time = 2.0
+        # expected wait for upstream capacity (rate-limit tokens) once a slot
+        # is held; installed by llm_router
+        self.capacity_wait: Optional[Callable[[str], float]] = None
+
+    def _waiting(self) -> int:
+        return sum(len(q) for q in self._queues.values())
+
+    def estimated_wait(self, priority: str) -> float:
+        """Rough wait (queue + upstream capacity) for a newcomer of `priority`."""
+        rank = PRIORITY_CLASSES.index(priority)
+        ahead = sum(len(self._queues[p]) for p in PRIORITY_CLASSES[:rank + 1])
+        capacity = self.capacity_wait(priority) if self.capacity_wait else 0.0
+        if self.active < self.max_concurrency and ahead == 0:
+            return capacity
+        return (ahead + 1) / self.max_concurrency * self._service_time + capacity
+
+    def _shed_below(self, priority: str) -> bool:
+        """Reject the newest queued waiter of the lowest class below `priority`."""
+        rank = PRIORITY_CLASSES.index(priority)
+        for victim in reversed(PRIORITY_CLASSES[rank + 1:]):
+            queue = self._queues[victim]
+            while queue:
+                fut = queue.pop()
+                if fut.done():
+                    continue
+                fut.set_exception(SchedulerRejected(victim, "shed under pressure",
+                                                    math.ceil(self._service_time)))
+                self._stats[victim].shed += 1
+                return True
+        return False
+
+    def _reject(self, priority: str, reason: str, retry_after: float) -> None:
+        self._stats[priority].rejected += 1
+        if priority == "interactive":
+            record_overload()
+        raise SchedulerRejected(priority, reason, math.ceil(retry_after))
+
+    async def acquire(self, priority: str) -> float:
+        """Wait for a slot; returns the time spent queued."""
+        if priority not in self._queues:
+            priority = "interactive"
+        stats = self._stats[priority]
+
+        if priority == "interactive":
+            wait = self.estimated_wait(priority)
+            if wait + self._service_time > self.turn_deadline:
+                self._reject(priority, "turn deadline would be exceeded", wait)
+
+        if self.active < self.max_concurrency and self._waiting() == 0:
+            self.active += 1
+            stats.admitted += 1
+            stats.waits.append(0.0)
+            return 0.0
+
+        while self._waiting() >= self.pressure_queue and self._shed_below(priority):
+            pass
+
+        queue = self._queues[priority]
+        if len(queue) >= self.queue_limits.get(priority, 0):
+            self._reject(priority, "queue full", self.estimated_wait(priority))
+
+        fut = asyncio.get_running_loop().create_future()
+        queue.append(fut)
+        started = time.monotonic()
+        try:
+            await fut
+        except SchedulerRejected:
+            raise
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled() and fut.exception() is None:
+                # the slot was handed over just as we were cancelled
+                self.release()
+            elif fut in queue:
+                queue.remove(fut)
+            raise
+        waited = time.monotonic() - started
+        stats.admitted += 1
+        stats.waits.append(waited)
+        return waited
+
+    def release(self, service_time: Optional[float] = None) -> None:
+        if service_time is not None:
+            self._service_time = 0.8 * self._service_time + 0.2 * service_time
+        for priority in PRIORITY_CLASSES:
+            queue = self._queues[priority]
+            while queue:
+                fut = queue.popleft()
+                if not fut.done():
+                    # hand the slot straight to the next waiter
+                    fut.set_result(None)
+                    return
+        self.active -= 1
+
+    @asynccontextmanager
+    async def slot(self, priority: str):
+        await self.acquire(priority)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - started)
+
+    def snapshot(self) -> Dict:
+        return {
+            "active": self.active,
+            "max_concurrency": self.max_concurrency,
+            "service_time_ms": round(self._service_time * 1000, 1),
+            "classes": {p: self._stats[p].snapshot(len(self._queues[p])) for p in PRIORITY_CLASSES},
+        }
+
+
+scheduler = LLMScheduler()
+
+
+def get_scheduler_metrics() -> Dict:
+    return scheduler.snapshot()
@@ -0,0 +1,314 @@
+# app/shared_state.py
+"""
+Pluggable shared-state backend.
+
+With several uvicorn workers (or hosts) a candidate's next turn can land on a
+worker that never saw the previous one, so state that must survive across
+turns goes through a StateBackend instead of module-level dicts:
+
+ - InProcessBackend: bounded, TTL-evicted dict; the default, and what a single
+   worker needs
+ - RespBackend: networked key-value store speaking the Redis wire protocol
+   (RESP), so Redis, Valkey, KeyDB or any compatible server works; selected
+   with STATE_BACKEND_URL=redis://[:password@]host[:port][/db]
+
+Both backends only expose batched operations (get_many / set_many /
+delete_many). RespBackend pipelines each batch into a single round-trip, so a
+turn loads everything it needs with one get_many and persists with one
+set_many: its writes are collected in a WriteBatch and flushed once, through
+write_behind(), off the request path. A TTL can be given for the whole batch
+or per key.
+
+Values must be JSON-serialisable; both backends store them as JSON so the
+in-process backend behaves exactly like the networked one.
+"""
+
+from typing import Any, Dict, List, Optional, Tuple, Union
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from urllib.parse import urlparse
+import asyncio
+import json
+import os
+import time
+
+STATE_BACKEND_URL = os.getenv("STATE_BACKEND_URL", "")
+STATE_KEY_PREFIX = os.getenv("STATE_KEY_PREFIX", "intervista:")
+STATE_MAX_ENTRIES = int(os.getenv("STATE_MAX_ENTRIES", "20000"))
+STATE_POOL_SIZE = int(os.getenv("STATE_POOL_SIZE", "4"))
+
+# One TTL for every item of a batch, or {key: ttl}; None means no expiry
+TTL = Union[None, float, Dict[str, Optional[float]]]
+
+
+class StateBackendError(Exception):
+    pass
+
+
+def _ttl_for(ttl: TTL, key: str) -> Optional[float]:
+    return ttl.get(key) if isinstance(ttl, dict) else ttl
+
+
+class StateBackend(ABC):
+    """Interface for shared state; every call is one batch / one round-trip."""
+
+    @abstractmethod
+    async def get_many(self, keys: List[str]) -> Dict[str, Any]:
+        """Return {key: value} for the keys that exist."""
+
+    @abstractmethod
+    async def set_many(self, items: Dict[str, Any], ttl: TTL = None) -> None:
+        """Store all items, each expiring after its `ttl` seconds (None = no expiry)."""
+
+    @abstractmethod
+    async def delete_many(self, keys: List[str]) -> None:
+        """Remove the keys (missing keys are ignored)."""
+
+    async def close(self) -> None:
+        pass
+
+
+class InProcessBackend(StateBackend):
+    """Per-process dict with TTLs and a size bound (oldest writes evicted first)."""
+
+    def __init__(self, max_entries: int = STATE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._data: "OrderedDict[str, Tuple[Optional[float], str]]" = OrderedDict()
+
+    def _live(self, key: str) -> Optional[str]:
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        expires, raw = entry
+        if expires is not None and expires <= time.monotonic():
+            del self._data[key]
+            return None
+        return raw
+
+    async def get_many(self, keys: List[str]) -> Dict[str, Any]:
+        out = {}
+        for key in keys:
+            raw = self._live(key)
+            if raw is not None:
+                out[key] = json.loads(raw)
+        return out
+
+    async def set_many(self, items: Dict[str, Any], ttl: TTL = None) -> None:
+        now = time.monotonic()
+        for key, value in items.items():
+            item_ttl = _ttl_for(ttl, key)
+            self._data[key] = (now + item_ttl if item_ttl else None, json.dumps(value))
+            self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+
+    async def delete_many(self, keys: List[str]) -> None:
+        for key in keys:
+            self._data.pop(key, None)
+
+
+def _encode_command(*args) -> bytes:
+    out = [b"*%d\r\n" % len(args)]
+    for arg in args:
+        if not isinstance(arg, bytes):
+            arg = str(arg).encode("utf-8")
+        out.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+    return b"".join(out)
+
+
+async def _read_reply(reader: asyncio.StreamReader):
+    line = await reader.readline()
+    if not line:
+        raise StateBackendError("connection closed by state backend")
+    kind, payload = line[:1], line[1:-2]
+    if kind == b"+":
+        return payload.decode()
+    if kind == b"-":
+        raise StateBackendError(payload.decode())
+    if kind == b":":
+        return int(payload)
+    if kind == b"$":
+        size = int(payload)
+        if size < 0:
+            return None
+        data = await reader.readexactly(size + 2)
+        return data[:-2]
+    if kind == b"*":
+        count = int(payload)
+        if count < 0:
+            return None
+        return [await _read_reply(reader) for _ in range(count)]
+    raise StateBackendError(f"unexpected reply from state backend: {line!r}")
+
+
+class RespBackend(StateBackend):
+    """
+    Networked backend over the Redis wire protocol with a small connection
+    pool. Each batch is written as one pipeline and its replies read back
+    together.
+    """
+
+    def __init__(self, url: str, pool_size: int = STATE_POOL_SIZE, timeout: float = 2.0):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "127.0.0.1"
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db = int(parsed.path.strip("/") or 0)
+        self.pool_size = max(pool_size, 1)
+        self.timeout = timeout
+        self._idle: List[Tuple[asyncio.StreamReader, asyncio.StreamWriter]] = []
+        self._slots: Optional[asyncio.Semaphore] = None
+
+    async def _connect(self):
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port), timeout=self.timeout)
+        setup = []
+        if self.password:
+            setup.append(_encode_command("AUTH", self.password))
+        if self.db:
+            setup.append(_encode_command("SELECT", self.db))
+        if setup:
+            try:
+                writer.write(b"".join(setup))
+                await writer.drain()
+                for _ in setup:
+                    await _read_reply(reader)
+            except Exception:
+                writer.close()
+                raise
+        return reader, writer
+
+    async def _pipeline(self, commands: List[bytes]) -> List[Any]:
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.pool_size)
+        async with self._slots:
+            conn = self._idle.pop() if self._idle else await self._connect()
+            reader, writer = conn
+            try:
+                writer.write(b"".join(commands))
+                await writer.drain()
+                replies, error = [], None
+                for _ in commands:
+                    try:
+                        replies.append(await asyncio.wait_for(_read_reply(reader), timeout=self.timeout))
+                    except StateBackendError as e:
+                        if "connection closed" in str(e):
+                            raise
+                        # error reply: keep reading so the connection stays in sync
+                        error = error or e
+                        replies.append(None)
+            except Exception:
+                # timeouts / resets leave the stream in an unknown state
+                writer.close()
+                raise
+            self._idle.append(conn)
+            if error is not None:
+                raise error
+            return replies
+
+    async def get_many(self, keys: List[str]) -> Dict[str, Any]:
+        if not keys:
+            return {}
+        (values,) = await self._pipeline([_encode_command("MGET", *keys)])
+        return {k: json.loads(v) for k, v in zip(keys, values) if v is not None}
+
+    async def set_many(self, items: Dict[str, Any], ttl: TTL = None) -> None:
+        if not items:
+            return
+        commands = []
+        for key, value in items.items():
+            args = ["SET", key, json.dumps(value)]
+            item_ttl = _ttl_for(ttl, key)
+            if item_ttl:
+                args += ["PX", int(item_ttl * 1000)]
+            commands.append(_encode_command(*args))
+        await self._pipeline(commands)
+
+    async def delete_many(self, keys: List[str]) -> None:
+        if keys:
+            await self._pipeline([_encode_command("DEL", *keys)])
+
+    async def close(self) -> None:
+        while self._idle:
+            _, writer = self._idle.pop()
+            writer.close()
+
+
+def create_backend(url: str = STATE_BACKEND_URL) -> StateBackend:
+    if url.startswith("redis://"):
+        return RespBackend(url)
+    return InProcessBackend()
+
+
+state_backend: StateBackend = create_backend()
+
+_pending_writes = set()
+_metrics = {"reads": 0, "read_errors": 0, "writes": 0, "write_errors": 0}
+
+
+def state_key(*parts: str) -> str:
+    return STATE_KEY_PREFIX + ":".join(str(p) for p in parts)
+
+
+async def read_many(keys: List[str]) -> Dict[str, Any]:
+    """
+    One batched read. Shared state is an optimisation, so a backend failure
+    is logged and treated as "nothing stored" rather than failing the turn.
+    """
+    if not keys:
+        return {}
+    try:
+        values = await state_backend.get_many(keys)
+        _metrics["reads"] += 1
+        return values
+    except Exception as e:
+        _metrics["read_errors"] += 1
+        print(f"Shared state read failed: {str(e)}")
+        return {}
+
+
+def write_behind(items: Dict[str, Any], ttl: TTL = None) -> None:
+    """
+    Persist `items` in the background (one pipelined set_many) so the write
+    round-trip stays off the request's critical path.
+    """
+    if not items:
+        return
+
+    async def _write():
+        try:
+            await state_backend.set_many(items, ttl=ttl)
+            _metrics["writes"] += 1
+        except Exception as e:
+            _metrics["write_errors"] += 1
+            print(f"Shared state write failed: {str(e)}")
+
+    task = asyncio.create_task(_write())
+    _pending_writes.add(task)
+    task.add_done_callback(_pending_writes.discard)
+
+
+class WriteBatch:
+    """Writes collected over one turn and persisted together by flush()."""
+
+    def __init__(self):
+        self.items: Dict[str, Any] = {}
+        self.ttls: Dict[str, Optional[float]] = {}
+
+    def add(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        self.items[key] = value
+        self.ttls[key] = ttl
+
+    def flush(self) -> None:
+        """Hand everything collected so far to write_behind() as one batch."""
+        items, ttls = self.items, self.ttls
+        self.items, self.ttls = {}, {}
+        write_behind(items, ttl=ttls)
+
+
+def get_state_metrics() -> Dict[str, Any]:
+    return {
+        "backend": type(state_backend).__name__,
+        "pending_writes": len(_pending_writes),
+        **_metrics,
+    }
@@ -0,0 +1,434 @@
+# app/similarity_index.py
+"""
+Near-duplicate detection for questions and answers.
+
+Texts are reduced to MinHash signatures: NUM_PERM minimum hash values over the
+character 5-gram shingles of the normalised text. The fraction of positions
+where two signatures agree estimates the Jaccard similarity of their shingle
+sets, so rephrasings with small edits still score high.
+
+Two indexes use these signatures:
+
+ - SessionIndex: the questions asked and answers given in one session. It
+   holds a few dozen signatures, so lookups compare all of them in a single
+   vectorised step. Its texts are stored in the session's shared-state record,
+   so a worker that has not seen the session yet rebuilds it from there.
+ - MinHashIndex: every non-trivial answer seen by this worker, across all
+   sessions, up to SIMILARITY_MAX_ENTRIES (oldest overwritten first).
+   Signatures live in one growing uint32 array. LSH banding (BANDS bands of
+   ROWS values) narrows each lookup to a handful of candidates:
+     * the band keys of all rows are kept in one sorted array, queried with a
+       single np.searchsorted
+     * new rows go to a small unsorted delta that is scanned directly; every
+       DELTA_SIZE inserts the delta is merged into a new sorted array on a
+       worker thread (off the event loop) and swapped in when done
+   Lookups take well under a millisecond at hundreds of thousands of entries.
+
+Thresholds:
+ - SIMILARITY_QUESTION_THRESHOLD: a next question at least this similar to
+   one already asked in the session is regenerated
+ - SIMILARITY_ANSWER_THRESHOLD: an answer at least this similar to an earlier
+   one (same session or any other) is flagged as recycled
+"""
+
+from typing import Any, Dict, List, Optional, Tuple
+from collections import OrderedDict, deque
+import asyncio
+import os
+import re
+import time
+
+import numpy as np
+
+from .shared_state import WriteBatch, state_key, write_behind
+
+SIMILARITY_ENABLED = os.getenv("SIMILARITY_ENABLED", "1") != "0"
+SIMILARITY_QUESTION_THRESHOLD = float(os.getenv("SIMILARITY_QUESTION_THRESHOLD", "0.6"))
+SIMILARITY_ANSWER_THRESHOLD = float(os.getenv("SIMILARITY_ANSWER_THRESHOLD", "0.8"))
+SIMILARITY_MAX_ENTRIES = int(os.getenv("SIMILARITY_MAX_ENTRIES", "200000"))
+SIMILARITY_MAX_SESSIONS = int(os.getenv("SIMILARITY_MAX_SESSIONS", "1000"))
+SIMILARITY_STATE_TTL = float(os.getenv("SIMILARITY_STATE_TTL", "1800"))
+# Texts kept per session and kind (questions / answers)
+SIMILARITY_SESSION_ITEMS = 50
+
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+SHINGLE_SIZE = 5
+MAX_TEXT_CHARS = 2000
+DELTA_SIZE = 4096
+# Merges between prunes of entries left behind by overwritten rows
+PRUNE_EVERY = 8
+# Cap on candidates taken from a single LSH bucket
+MAX_BUCKET = 64
+
+# Fixed seed: every worker must produce identical signatures. Each
+# permutation is a multiply-shift hash: high 32 bits of (a * x + b) mod 2^64.
+_rng = np.random.default_rng(20240611)
+_PERM_A = _rng.integers(1, 1 << 63, NUM_PERM, dtype=np.uint64)[:, None] | np.uint64(1)
+_PERM_B = _rng.integers(0, 1 << 63, NUM_PERM, dtype=np.uint64)[:, None]
+_SHIFT = np.uint64(32)
+_BAND_MIX = _rng.integers(1, 1 << 63, ROWS, dtype=np.uint64) | np.uint64(1)
+_BAND_IDS = np.arange(BANDS, dtype=np.uint64) << np.uint64(60)
+_KEY_MASK = np.uint64((1 << 60) - 1)
+
+_NON_WORD_RE = re.compile(r"[^\w]+")
+
+
+def normalize(text: str) -> str:
+    return _NON_WORD_RE.sub(" ", (text or "").lower()).strip()
+
+
+def _shingles(text: str) -> np.ndarray:
+    data = np.frombuffer(normalize(text)[:MAX_TEXT_CHARS].encode("utf-8"), dtype=np.uint8)
+    if data.size == 0:
+        return np.empty(0, dtype=np.uint64)
+    n = min(SHINGLE_SIZE, data.size)
+    data = data.astype(np.uint64)
+    count = data.size - n + 1
+    hashes = np.zeros(count, dtype=np.uint64)
+    for j in range(n):
+        hashes = hashes * np.uint64(257) + data[j:j + count]
+    return hashes
+
+
+def minhash(text: str) -> Optional[np.ndarray]:
+    """MinHash signature (NUM_PERM uint32 values), or None for empty text."""
+    shingles = _shingles(text)
+    if shingles.size == 0:
+        return None
+    return ((_PERM_A * shingles + _PERM_B) >> _SHIFT).astype(np.uint32).min(axis=1)
+
+
+def _band_keys(sigs: np.ndarray) -> np.ndarray:
+    """
+    One 64-bit key per band: the band's ROWS values mixed into 60 bits, with
+    the band number in the top 4 bits so all bands share one sorted array.
+    """
+    bands = sigs.reshape(-1, BANDS, ROWS).astype(np.uint64)
+    mixed = np.bitwise_xor.reduce(bands * _BAND_MIX, axis=-1)
+    return (mixed & _KEY_MASK) | _BAND_IDS
+
+
+def _merged(sorted_keys: np.ndarray, sorted_rows: np.ndarray, rows: np.ndarray,
+            row_keys: np.ndarray, live_keys: Optional[np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    New sorted (keys, rows) arrays with the band keys of `rows` merged in.
+    With `live_keys`, entries of rows whose keys have since changed are
+    dropped. Pure NumPy on its inputs, so it can run off the event loop.
+    """
+    keys = row_keys.ravel()
+    rows = np.repeat(rows, BANDS)
+    order = np.argsort(keys, kind="stable")
+    keys, rows = keys[order], rows[order]
+    at = np.searchsorted(sorted_keys, keys, side="right")
+    sorted_keys = np.insert(sorted_keys, at, keys)
+    sorted_rows = np.insert(sorted_rows, at, rows)
+    if live_keys is not None:
+        bands = (sorted_keys >> np.uint64(60)).astype(np.intp)
+        live = live_keys[sorted_rows, bands] == sorted_keys
+        sorted_keys, sorted_rows = sorted_keys[live], sorted_rows[live]
+    return sorted_keys, sorted_rows
+
+
+def _agreement(sigs: np.ndarray, sig: np.ndarray) -> np.ndarray:
+    """Estimated Jaccard similarity of `sig` to each row of `sigs`."""
+    return (sigs == sig).mean(axis=1)
+
+
+class MinHashIndex:
+    """Bounded signature store with LSH lookup."""
+
+    def __init__(self, max_entries: int = SIMILARITY_MAX_ENTRIES):
+        self.max_entries = max(max_entries, 1)
+        capacity = min(1024, self.max_entries)
+        self._sigs = np.zeros((capacity, NUM_PERM), dtype=np.uint32)
+        self._keys = np.zeros((capacity, BANDS), dtype=np.uint64)
+        self._owners: List[str] = []
+        self._count = 0
+        self._sorted_keys = np.empty(0, dtype=np.uint64)
+        self._sorted_rows = np.empty(0, dtype=np.int32)
+        # keeps absorbing inserts (growing if needed) while a merge runs
+        self._delta = np.zeros(2 * DELTA_SIZE, dtype=np.int32)
+        self._delta_len = 0
+        self._merging: Optional[asyncio.Future] = None
+        self.merges = 0
+
+    def __len__(self) -> int:
+        return min(self._count, self.max_entries)
+
+    def _grow(self) -> None:
+        capacity = min(self._sigs.shape[0] * 2, self.max_entries)
+        sigs = np.zeros((capacity, NUM_PERM), dtype=np.uint32)
+        keys = np.zeros((capacity, BANDS), dtype=np.uint64)
+        sigs[:len(self)] = self._sigs[:len(self)]
+        keys[:len(self)] = self._keys[:len(self)]
+        self._sigs, self._keys = sigs, keys
+
+    def _merge_inputs(self, count: int):
+        rows = self._delta[:count].copy()
+        # pruning overwritten rows scans every entry, so only do it now and then
+        prune = self._count > self.max_entries and self.merges % PRUNE_EVERY == 0
+        live = self._keys if prune else None
+        return self._sorted_keys, self._sorted_rows, rows, self._keys[rows], live
+
+    def _apply_merge(self, count: int, merged: Tuple[np.ndarray, np.ndarray]) -> None:
+        """Swap in the merged arrays and drop the first `count` delta rows."""
+        self._sorted_keys, self._sorted_rows = merged
+        rest = self._delta_len - count
+        self._delta[:rest] = self._delta[count:self._delta_len]
+        self._delta_len = rest
+        self.merges += 1
+
+    def _start_merge(self) -> None:
+        """Merge the current delta on a worker thread (inline without a loop)."""
+        count = self._delta_len
+        inputs = self._merge_inputs(count)
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._apply_merge(count, _merged(*inputs))
+            return
+        self._merging = loop.run_in_executor(None, _merged, *inputs)
+        self._merging.add_done_callback(lambda fut: self._finish_merge(fut, count))
+
+    def _finish_merge(self, fut: asyncio.Future, count: int) -> None:
+        self._merging = None
+        if fut.cancelled():
+            return
+        if fut.exception() is not None:
+            print(f"Similarity index merge failed: {str(fut.exception())}")
+            return
+        self._apply_merge(count, fut.result())
+
+    def add(self, sig: np.ndarray, owner: str = "") -> int:
+        row = self._count % self.max_entries
+        if row >= self._sigs.shape[0]:
+            self._grow()
+        self._sigs[row] = sig
+        self._keys[row] = _band_keys(sig)[0]
+        if row < len(self._owners):
+            self._owners[row] = owner
+        else:
+            self._owners.append(owner)
+        self._count += 1
+        if self._delta_len == self._delta.size:
+            self._delta = np.concatenate([self._delta, np.zeros_like(self._delta)])
+        self._delta[self._delta_len] = row
+        self._delta_len += 1
+        if self._delta_len >= DELTA_SIZE and self._merging is None:
+            self._start_merge()
+        return row
+
+    def _candidates(self, keys: np.ndarray) -> np.ndarray:
+        parts = []
+        if self._sorted_keys.size:
+            lo = np.searchsorted(self._sorted_keys, keys, side="left")
+            hi = np.searchsorted(self._sorted_keys, keys, side="right")
+            for start, end in zip(lo[hi > lo], hi[hi > lo]):
+                parts.append(self._sorted_rows[start:min(end, start + MAX_BUCKET)])
+        if self._delta_len:
+            delta = self._delta[:self._delta_len]
+            parts.append(delta[(self._keys[delta] == keys).any(axis=1)])
+        if not parts:
+            return np.empty(0, dtype=np.int32)
+        rows = np.unique(np.concatenate(parts))
+        # rows overwritten since the last merge no longer share a band
+        return rows[(self._keys[rows] == keys).any(axis=1)]
+
+    def query(self, sig: np.ndarray, exclude_owner: Optional[str] = None) -> Tuple[float, Optional[str]]:
+        """Best (similarity, owner) among LSH candidates; (0.0, None) if none."""
+        rows = self._candidates(_band_keys(sig)[0])
+        if exclude_owner is not None and rows.size:
+            rows = rows[[self._owners[r] != exclude_owner for r in rows]]
+        if rows.size == 0:
+            return 0.0, None
+        scores = _agreement(self._sigs[rows], sig)
+        best = int(scores.argmax())
+        return float(scores[best]), self._owners[rows[best]]
+
+
+class _TextSet:
+    """Small list of texts with their signatures, compared by brute force."""
+
+    def __init__(self):
+        self.texts: List[str] = []
+        self._sigs = np.zeros((0, NUM_PERM), dtype=np.uint32)
+
+    def add(self, text: str, sig: Optional[np.ndarray] = None) -> None:
+        text = (text or "").strip()
+        if not text or text in self.texts:
+            return
+        sig = minhash(text) if sig is None else sig
+        if sig is None:
+            return
+        self.texts.append(text)
+        self._sigs = np.vstack([self._sigs, sig])[-SIMILARITY_SESSION_ITEMS:]
+        self.texts = self.texts[-SIMILARITY_SESSION_ITEMS:]
+
+    def best(self, sig: Optional[np.ndarray]) -> Tuple[float, Optional[str]]:
+        if sig is None or not self.texts:
+            return 0.0, None
+        scores = _agreement(self._sigs, sig)
+        i = int(scores.argmax())
+        return float(scores[i]), self.texts[i]
+
+
+class SessionIndex:
+    """Questions asked and answers given in one session."""
+
+    def __init__(self):
+        self.questions = _TextSet()
+        self.answers = _TextSet()
+
+    @classmethod
+    def from_record(cls, record: Dict[str, Any]) -> "SessionIndex":
+        index = cls()
+        for text in record.get("questions") or []:
+            index.questions.add(text)
+        for text in record.get("answers") or []:
+            index.answers.add(text)
+        return index
+
+    def size(self) -> int:
+        return len(self.questions.texts) + len(self.answers.texts)
+
+    def to_record(self) -> Dict[str, List[str]]:
+        return {"questions": list(self.questions.texts), "answers": list(self.answers.texts)}
+
+    def question_similarity(self, question: str) -> Tuple[float, Optional[str]]:
+        """(similarity, closest earlier question) for a candidate question."""
+        started = time.perf_counter()
+        result = self.questions.best(minhash(question))
+        _record_lookup(started)
+        return result
+
+
+_sessions: "OrderedDict[str, SessionIndex]" = OrderedDict()
+global_answers = MinHashIndex()
+
+_lookup_times = deque(maxlen=500)
+_metrics = {
+    "questions_checked": 0,
+    "near_duplicate_questions": 0,
+    "regenerated": 0,
+    "replaced_local": 0,
+    "answers_indexed": 0,
+    "recycled_answers": 0,
+    "sessions_restored": 0,
+}
+
+
+def _record_lookup(started: float) -> None:
+    _lookup_times.append(time.perf_counter() - started)
+
+
+def similarity_state_key(session_id: str) -> str:
+    """Shared-state key of a session's question/answer texts."""
+    return state_key("similarity", session_id)
+
+
+def session_index(session_id: str, shared: Optional[Dict[str, Any]] = None) -> SessionIndex:
+    """
+    The session's index on this worker, rebuilt from the shared-state record
+    when that record knows more than the local copy (the session's earlier
+    turns ran on another worker). Without a session id a throwaway index is
+    returned.
+    """
+    if not session_id:
+        return SessionIndex.from_record(shared or {})
+    index = _sessions.get(session_id)
+    if shared:
+        stored = len(shared.get("questions") or []) + len(shared.get("answers") or [])
+        if index is None or stored > index.size():
+            index = SessionIndex.from_record(shared)
+            _metrics["sessions_restored"] += 1
+    if index is None:
+        index = SessionIndex()
+    _sessions[session_id] = index
+    _sessions.move_to_end(session_id)
+    while len(_sessions) > SIMILARITY_MAX_SESSIONS:
+        _sessions.popitem(last=False)
+    return index
+
+
+def score_answer(session_id: str, index: SessionIndex,
+                 answer: str) -> Tuple[Dict[str, Any], Optional[np.ndarray]]:
+    """
+    Score an answer against the session's earlier answers and against other
+    sessions' answers. Returns the scores and the answer's signature, which
+    commit_turn() adds to the indexes once the turn has succeeded (so a
+    retried turn is never scored against itself).
+    """
+    started = time.perf_counter()
+    sig = minhash(answer)
+    session_max, _ = index.answers.best(sig)
+    global_max = 0.0
+    if sig is not None:
+        global_max, _ = global_answers.query(sig, exclude_owner=session_id or None)
+    _record_lookup(started)
+    recycled = max(session_max, global_max) >= SIMILARITY_ANSWER_THRESHOLD
+    if recycled:
+        _metrics["recycled_answers"] += 1
+    return {
+        "answer_session_max": round(session_max, 3),
+        "answer_global_max": round(global_max, 3),
+        "recycled_answer": recycled,
+    }, sig
+
+
+def commit_turn(session_id: str, index: SessionIndex, answer: str,
+                answer_sig: Optional[np.ndarray], question: str,
+                writes: Optional[WriteBatch] = None) -> None:
+    """
+    Record a completed turn's answer and next question, and persist the
+    session (added to `writes` when the caller batches the turn's writes).
+    """
+    if answer_sig is not None and answer.strip() not in index.answers.texts:
+        global_answers.add(answer_sig, owner=session_id)
+        index.answers.add(answer, answer_sig)
+        _metrics["answers_indexed"] += 1
+    index.questions.add(question)
+    persist_session(session_id, index, writes)
+
+
+def least_similar(index: SessionIndex, candidates: List[str]) -> Tuple[Optional[str], float]:
+    """The candidate question least similar to anything already asked."""
+    best, best_score = None, 2.0
+    for text in candidates:
+        score, _ = index.question_similarity(text)
+        if score < best_score:
+            best, best_score = text, score
+    return best, (best_score if best is not None else 0.0)
+
+
+def record_question_check(similarity: float, regenerated: bool = False, replaced_local: bool = False) -> None:
+    _metrics["questions_checked"] += 1
+    if similarity >= SIMILARITY_QUESTION_THRESHOLD:
+        _metrics["near_duplicate_questions"] += 1
+    if regenerated:
+        _metrics["regenerated"] += 1
+    if replaced_local:
+        _metrics["replaced_local"] += 1
+
+
+def persist_session(session_id: str, index: SessionIndex, writes: Optional[WriteBatch] = None) -> None:
+    if not session_id:
+        return
+    if writes is not None:
+        writes.add(similarity_state_key(session_id), index.to_record(), ttl=SIMILARITY_STATE_TTL)
+    else:
+        write_behind({similarity_state_key(session_id): index.to_record()}, ttl=SIMILARITY_STATE_TTL)
+
+
+def get_similarity_metrics() -> Dict[str, Any]:
+    times = sorted(_lookup_times)
+    return {
+        "enabled": SIMILARITY_ENABLED,
+        "global_answers": len(global_answers),
+        "global_merges": global_answers.merges,
+        "sessions": len(_sessions),
+        "lookup_p50_ms": round(times[len(times) // 2] * 1000, 3) if times else 0.0,
+        "lookup_p95_ms": round(times[int(0.95 * (len(times) - 1))] * 1000, 3) if times else 0.0,
+        **_metrics,
+    }
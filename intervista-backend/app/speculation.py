@@ -0,0 +1,222 @@
+# app/speculation.py
+"""
+Speculative next-question pre-generation.
+
+The candidate spends 30-120 s composing an answer while the backend sits idle.
+After each turn we guess which DIPE routes are most likely to win on the next
+turn (see dipe_engine.likely_next_types) and generate a question for each of
+them in the background. When the next answer arrives and DIPE has picked its
+route, the pre-generated question for that route is used instead of making a
+fresh, serial question-generation call.
+
+Speculative questions are generated from the previous answer (the next one
+does not exist yet), so they trade a little specificity for latency.
+
+Once every launched route has finished, the completed pre-generations are
+written to the session's shared-state record in one write, so a turn that
+lands on another worker can still reuse them (the caller passes that record
+in as `shared`). Pending tasks stay per worker.
+
+Limits:
+ - SPECULATION_MAX_TYPES: routes pre-generated per session and turn
+ - SPECULATION_MAX_INFLIGHT: speculative LLM calls in flight across all sessions
+ - SPECULATION_MAX_SESSIONS: sessions tracked (oldest evicted and cancelled)
+"""
+
+from typing import Awaitable, Callable, Dict, List, Optional
+from collections import OrderedDict
+import asyncio
+import os
+
+from .shared_state import state_key, write_behind
+
+SPECULATION_ENABLED = os.getenv("SPECULATION_ENABLED", "1") != "0"
+SPECULATION_MAX_TYPES = int(os.getenv("SPECULATION_MAX_TYPES", "2"))
+SPECULATION_MAX_INFLIGHT = int(os.getenv("SPECULATION_MAX_INFLIGHT", "32"))
+SPECULATION_MAX_SESSIONS = int(os.getenv("SPECULATION_MAX_SESSIONS", "1000"))
+# How long a submit may wait for a pre-generation that is still running
+SPECULATION_AWAIT_TIMEOUT = float(os.getenv("SPECULATION_AWAIT_TIMEOUT", "10"))
+SPECULATION_STATE_TTL = float(os.getenv("SPECULATION_STATE_TTL", "1800"))
+
+
+def session_state_key(session_id: str) -> str:
+    """Shared-state key of a session's speculation record."""
+    return state_key("session", session_id)
+
+
+class _SessionSpeculation:
+    """Pre-generated question tasks for one session, valid for one turn."""
+
+    def __init__(self, for_turn: int):
+        self.for_turn = for_turn
+        self.tasks: Dict[str, asyncio.Task] = {}
+        self.questions: Dict[str, str] = {}
+
+
+_sessions: "OrderedDict[str, _SessionSpeculation]" = OrderedDict()
+_inflight = 0
+_publishers = set()
+
+_metrics = {
+    "launched": 0,
+    "hits": 0,
+    "late_hits": 0,
+    "shared_hits": 0,
+    "misses": 0,
+    "stale": 0,
+    "cancelled": 0,
+    "failed": 0,
+    "skipped_budget": 0,
+}
+
+
+def _cancel_entry(entry: _SessionSpeculation, keep: Optional[str] = None) -> None:
+    for qtype, task in entry.tasks.items():
+        if qtype != keep and not task.done():
+            task.cancel()
+            _metrics["cancelled"] += 1
+
+
+def cancel_speculation(session_id: str) -> None:
+    """Drop and cancel any pending pre-generations for a session."""
+    entry = _sessions.pop(session_id, None)
+    if entry is not None:
+        _cancel_entry(entry)
+
+
+async def _run_speculative(make_question: Callable[[str], Awaitable[str]], qtype: str,
+                           entry: _SessionSpeculation) -> str:
+    global _inflight
+    _inflight += 1
+    try:
+        question = await make_question(qtype)
+    except asyncio.CancelledError:
+        raise
+    except Exception:
+        _metrics["failed"] += 1
+        raise
+    finally:
+        _inflight -= 1
+    if question:
+        entry.questions[qtype] = question
+    return question
+
+
+async def _publish(session_id: str, entry: _SessionSpeculation) -> None:
+    """Write the session's pre-generations to shared state once all routes are done."""
+    await asyncio.wait(list(entry.tasks.values()))
+    # taken or replaced on this worker in the meantime: the record is stale
+    if _sessions.get(session_id) is entry and entry.questions:
+        write_behind(
+            {session_state_key(session_id): {"for_turn": entry.for_turn, "questions": dict(entry.questions)}},
+            ttl=SPECULATION_STATE_TTL
+        )
+
+
+def schedule_speculation(session_id: str,
+                         for_turn: int,
+                         qtypes: List[str],
+                         make_question: Callable[[str], Awaitable[str]]) -> List[str]:
+    """
+    Start background question generation for `qtypes` (most likely first),
+    replacing whatever was pending for the session. Returns the routes that
+    were actually launched within the budget.
+    """
+    if not SPECULATION_ENABLED or not session_id:
+        return []
+
+    cancel_speculation(session_id)
+    entry = _SessionSpeculation(for_turn)
+
+    for qtype in qtypes[:SPECULATION_MAX_TYPES]:
+        if _inflight + len(entry.tasks) >= SPECULATION_MAX_INFLIGHT:
+            _metrics["skipped_budget"] += 1
+            continue
+        task = asyncio.create_task(_run_speculative(make_question, qtype, entry))
+        # consume exceptions of tasks nobody ends up awaiting
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        entry.tasks[qtype] = task
+        _metrics["launched"] += 1
+
+    if entry.tasks:
+        _sessions[session_id] = entry
+        publisher = asyncio.create_task(_publish(session_id, entry))
+        _publishers.add(publisher)
+        publisher.add_done_callback(_publishers.discard)
+        while len(_sessions) > SPECULATION_MAX_SESSIONS:
+            _, evicted = _sessions.popitem(last=False)
+            _cancel_entry(evicted)
+
+    return list(entry.tasks)
+
+
+def _take_shared(shared: Optional[Dict], turn_count: int, qtype: str) -> Optional[str]:
+    if not shared:
+        # nothing was pre-generated for this session anywhere
+        return None
+    if shared.get("for_turn") != turn_count:
+        _metrics["stale"] += 1
+        return None
+    question = (shared.get("questions") or {}).get(qtype)
+    if question:
+        _metrics["hits"] += 1
+        _metrics["shared_hits"] += 1
+    else:
+        _metrics["misses"] += 1
+    return question
+
+
+async def take_speculated_question(session_id: str, turn_count: int, qtype: str,
+                                   shared: Optional[Dict] = None) -> Optional[str]:
+    """
+    Return the pre-generated question for the route DIPE actually chose,
+    or None on a miss. All other pending routes for the session are cancelled.
+    `shared` is the session's shared-state record, used when this worker has
+    no current local pre-generation for the route.
+    """
+    if not session_id:
+        return None
+    entry = _sessions.pop(session_id, None)
+    if entry is None:
+        return _take_shared(shared, turn_count, qtype)
+
+    task = entry.tasks.get(qtype) if entry.for_turn == turn_count else None
+    if task is None or task.cancelled():
+        # left over from an earlier turn (the last one ran on another worker),
+        # or the route was not pre-generated here: the shared record may have it
+        _cancel_entry(entry)
+        if shared:
+            return _take_shared(shared, turn_count, qtype)
+        _metrics["stale" if entry.for_turn != turn_count else "misses"] += 1
+        return None
+
+    _cancel_entry(entry, keep=qtype)
+
+    late = not task.done()
+    try:
+        question = await asyncio.wait_for(task, timeout=SPECULATION_AWAIT_TIMEOUT)
+    except asyncio.TimeoutError:
+        _metrics["misses"] += 1
+        return None
+    except Exception:
+        _metrics["misses"] += 1
+        return None
+
+    if not question:
+        _metrics["misses"] += 1
+        return None
+
+    _metrics["hits"] += 1
+    if late:
+        _metrics["late_hits"] += 1
+    return question
+
+
+def get_speculation_metrics() -> Dict[str, float]:
+    lookups = _metrics["hits"] + _metrics["misses"] + _metrics["stale"]
+    return {
+        **_metrics,
+        "inflight": _inflight,
+        "sessions": len(_sessions),
+        "hit_rate": round(_metrics["hits"] / lookups, 4) if lookups else 0.0,
+    }
@@ -0,0 +1,333 @@
+# app/traffic_capture.py
+"""
+Record-and-replay of /api/interview traffic.
+
+Capture (opt-in): set TRAFFIC_CAPTURE_PATH to append one compact JSON line per
+request with
+ - the sanitized request body
+ - every LLM call made on its behalf: call site, prompt body (the static
+   cacheable prefix is left out to keep the log compact), response, latency
+   and error
+ - per-stage timings of the turn, status code and total elapsed time
+Records are handed to a queue and written off the request path by one
+background task that keeps a single stream open, in batches, on a worker
+thread. A ".gz" path writes one gzip stream (sync-flushed every
+TRAFFIC_CAPTURE_FLUSH_SECONDS, closed on shutdown via close_capture()).
+Emails, phone numbers and other long digit runs are redacted before anything
+is written.
+
+Replay: replay_capture() re-drives a captured log against the current build
+(in-process, through the same endpoint handler) at a configurable speed-up
+and concurrency. LLM calls are served from the recording by call site and
+order, after the recorded latency divided by the speed-up, so throughput and
+parse-failure rates can be compared between versions offline. See
+replay_traffic.py for the command-line entry point.
+"""
+
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from contextvars import ContextVar
+import asyncio
+import gzip
+import json
+import os
+import re
+import time
+import zlib
+
+TRAFFIC_CAPTURE_PATH = os.getenv("TRAFFIC_CAPTURE_PATH", "")
+TRAFFIC_CAPTURE_FLUSH_SECONDS = float(os.getenv("TRAFFIC_CAPTURE_FLUSH_SECONDS", "2"))
+# Records buffered while the writer catches up; beyond this they are dropped
+TRAFFIC_CAPTURE_QUEUE_MAX = int(os.getenv("TRAFFIC_CAPTURE_QUEUE_MAX", "10000"))
+
+_EMAIL_RE = re.compile(r"[\w.+-]+@[\w-]+(\.[\w-]+)+")
+_PHONE_RE = re.compile(r"\+?\d[\d\s().-]{7,}\d")
+
+
+def sanitize(text: Any) -> Any:
+    """Redact contact details from captured free text."""
+    if not isinstance(text, str):
+        return text
+    text = _EMAIL_RE.sub("<email>", text)
+    return _PHONE_RE.sub("<number>", text)
+
+
+def _sanitize_request(body: Dict[str, Any]) -> Dict[str, Any]:
+    out = dict(body)
+    for field in ("question_context", "last_question", "user_answer"):
+        out[field] = sanitize(out.get(field, ""))
+    out["history"] = [
+        {k: sanitize(v) for k, v in h.items()} if isinstance(h, dict) else h
+        for h in out.get("history") or []
+    ]
+    return out
+
+
+class _Capture:
+    """Everything recorded for one request."""
+
+    def __init__(self, request: Dict[str, Any]):
+        self.started = time.perf_counter()
+        self.record: Dict[str, Any] = {
+            "v": 1,
+            "ts": time.time(),
+            "request": _sanitize_request(request),
+            "llm": [],
+            "stages": {},
+        }
+        self.closed = False
+
+
+_current: ContextVar[Optional[_Capture]] = ContextVar("traffic_capture", default=None)
+
+
+def capture_enabled() -> bool:
+    return bool(TRAFFIC_CAPTURE_PATH)
+
+
+def start_capture(request: Dict[str, Any]) -> Optional[_Capture]:
+    """Begin recording the current request; no-op unless capture is enabled."""
+    if not capture_enabled():
+        return None
+    cap = _Capture(request)
+    _current.set(cap)
+    return cap
+
+
+def record_llm_call(call_site: str, prompt: str, response: Optional[str],
+                    latency: float, error: Optional[str] = None) -> None:
+    cap = _current.get()
+    if cap is None or cap.closed:
+        # background work (e.g. speculation) finishing after the response
+        return
+    cap.record["llm"].append({
+        "site": call_site,
+        "prompt": sanitize(prompt),
+        "response": sanitize(response),
+        "latency": round(latency, 4),
+        "error": error,
+    })
+
+
+def record_stage(name: str, seconds: float) -> None:
+    cap = _current.get()
+    if cap is not None and not cap.closed:
+        cap.record["stages"][name] = round(seconds, 4)
+
+
+class _CaptureWriter:
+    """Single background writer: a queue drained in batches into one open stream."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.written = 0
+        self.dropped = 0
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stream = None
+        self._flushed = 0.0
+
+    def submit(self, line: str) -> None:
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=TRAFFIC_CAPTURE_QUEUE_MAX)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._drain())
+        try:
+            self._queue.put_nowait(line)
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    async def _drain(self) -> None:
+        while True:
+            batch = [await self._queue.get()]
+            while not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            # None is the close marker
+            closing = None in batch
+            batch = [line for line in batch if line is not None]
+            try:
+                if batch:
+                    await asyncio.to_thread(self._write, batch)
+                    self.written += len(batch)
+            except Exception as e:
+                self.dropped += len(batch)
+                print(f"Traffic capture write failed: {str(e)}")
+            if closing:
+                return
+
+    def _write(self, batch: List[str]) -> None:
+        if self._stream is None:
+            opener = gzip.open if self.path.endswith(".gz") else open
+            self._stream = opener(self.path, "ab")
+        self._stream.write("".join(line + "\n" for line in batch).encode("utf-8"))
+        now = time.monotonic()
+        if now - self._flushed >= TRAFFIC_CAPTURE_FLUSH_SECONDS:
+            # complete records become readable without ending the gzip stream
+            if isinstance(self._stream, gzip.GzipFile):
+                self._stream.flush(zlib.Z_SYNC_FLUSH)
+            else:
+                self._stream.flush()
+            self._flushed = now
+
+    async def close(self) -> None:
+        if self._task is not None and not self._task.done():
+            await self._queue.put(None)
+            await self._task
+        self._task = None
+        if self._stream is not None:
+            self._stream.close()
+            self._stream = None
+
+
+_writer = _CaptureWriter(TRAFFIC_CAPTURE_PATH)
+
+
+async def close_capture() -> None:
+    """Write out buffered records and close the capture stream (on shutdown)."""
+    if capture_enabled():
+        await _writer.close()
+
+
+def finish_capture(cap: Optional[_Capture], status: int) -> None:
+    """Close the record and append it to the capture log."""
+    if cap is None or cap.closed:
+        return
+    cap.closed = True
+    cap.record["status"] = status
+    cap.record["elapsed"] = round(time.perf_counter() - cap.started, 4)
+    _writer.submit(json.dumps(cap.record, separators=(",", ":")))
+
+
+def load_capture(path: str) -> List[Dict[str, Any]]:
+    opener = gzip.open if path.endswith(".gz") else open
+    records = []
+    with opener(path, "rt", encoding="utf-8") as f:
+        try:
+            for line in f:
+                line = line.strip()
+                if line:
+                    records.append(json.loads(line))
+        except (EOFError, json.JSONDecodeError):
+            # capture still open or cut short: keep the complete records
+            pass
+    records.sort(key=lambda r: r.get("ts", 0))
+    return records
+
+
+# ---------------------------
+# Replay
+# ---------------------------
+_replaying: ContextVar[Optional[Dict[str, List[Dict[str, Any]]]]] = ContextVar("traffic_replay", default=None)
+
+
+class ReplayTransport:
+    """
+    Serves LLM calls from a capture. Calls made while replaying a record are
+    answered from that record's calls for the same call site, in order; calls
+    the recording has no match for (e.g. speculative work) fall back to any
+    recorded call of that site.
+    """
+
+    def __init__(self, records: List[Dict[str, Any]], speedup: float = 1.0):
+        self.speedup = max(speedup, 1e-6)
+        self.pool: Dict[str, List[Dict[str, Any]]] = {}
+        for rec in records:
+            for call in rec.get("llm", []):
+                self.pool.setdefault(call["site"], []).append(call)
+        self.stats = {"calls": 0, "matched": 0, "fallback": 0, "unmatched": 0}
+        self.site_calls: Dict[str, int] = {}
+        self._rr: Dict[str, int] = {}
+
+    def _fallback(self, call_site: str) -> Optional[Dict[str, Any]]:
+        pool = self.pool.get(call_site) or self.pool.get("question_gen") or []
+        if not pool:
+            return None
+        i = self._rr.get(call_site, 0)
+        self._rr[call_site] = i + 1
+        return pool[i % len(pool)]
+
+    async def __call__(self, call_site: str, prompt: str) -> str:
+        self.stats["calls"] += 1
+        self.site_calls[call_site] = self.site_calls.get(call_site, 0) + 1
+        pending = _replaying.get()
+        call = None
+        if pending is not None and pending.get(call_site):
+            call = pending[call_site].pop(0)
+            self.stats["matched"] += 1
+        else:
+            call = self._fallback(call_site)
+            self.stats["fallback" if call else "unmatched"] += 1
+        if call is None:
+            raise RuntimeError(f"no recorded response for {call_site}")
+        await asyncio.sleep(call.get("latency", 0.0) / self.speedup)
+        if call.get("error"):
+            raise RuntimeError(call["error"])
+        return call.get("response") or ""
+
+
+def _percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+
+async def replay_capture(records: List[Dict[str, Any]],
+                         handle: Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]],
+                         transport: ReplayTransport,
+                         speedup: float = 1.0,
+                         concurrency: int = 8) -> Dict[str, Any]:
+    """
+    Re-drive `records` through `handle(request_body)` (which returns
+    {"status": int, "result": dict}), preserving the recorded inter-arrival
+    times divided by `speedup`, with at most `concurrency` requests in flight.
+    """
+    sem = asyncio.Semaphore(max(concurrency, 1))
+    latencies: List[float] = []
+    statuses: Dict[int, int] = {}
+    local_fallbacks = 0
+    speculative_hits = 0
+    t0 = records[0].get("ts", 0) if records else 0
+
+    async def one(rec):
+        nonlocal local_fallbacks, speculative_hits
+        pending = {}
+        for call in rec.get("llm", []):
+            pending.setdefault(call["site"], []).append(call)
+        async with sem:
+            _replaying.set(pending)
+            started = time.perf_counter()
+            out = await handle(rec["request"])
+            latencies.append(time.perf_counter() - started)
+        statuses[out["status"]] = statuses.get(out["status"], 0) + 1
+        dipe = (out.get("result") or {}).get("dipe_state") or {}
+        if dipe.get("scoring") == "local" and rec["request"].get("user_answer", "").split():
+            local_fallbacks += 1
+        if dipe.get("speculative_hit"):
+            speculative_hits += 1
+
+    started = time.perf_counter()
+    tasks = []
+    for rec in records:
+        delay = (rec.get("ts", t0) - t0) / max(speedup, 1e-6) - (time.perf_counter() - started)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(one(rec)))
+    await asyncio.gather(*tasks)
+    wall = time.perf_counter() - started
+
+    turns = len(records)
+    recorded_salvage = sum(1 for r in records if any(c["site"] == "salvage" for c in r.get("llm", [])))
+    return {
+        "requests": turns,
+        "wall_seconds": round(wall, 3),
+        "throughput_rps": round(turns / wall, 2) if wall > 0 else 0.0,
+        "latency_p50_ms": round(_percentile(latencies, 0.5) * 1000, 1),
+        "latency_p95_ms": round(_percentile(latencies, 0.95) * 1000, 1),
+        "status": statuses,
+        "parse_failure_rate": round(transport.site_calls.get("salvage", 0) / turns, 4) if turns else 0.0,
+        "recorded_parse_failure_rate": round(recorded_salvage / turns, 4) if turns else 0.0,
+        "local_fallbacks": local_fallbacks,
+        "speculative_hits": speculative_hits,
+        "llm_calls": transport.site_calls,
+        "transport": transport.stats,
+    }
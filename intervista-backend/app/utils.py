@@ -3,29 +3,31 @@ from dotenv import load_dotenv
 import os
 
 load_dotenv()
-import os
-import google.generativeai as genai
+from .llm_router import routed_generate
+from .scheduler import SchedulerRejected
 
-# Load API key from environment
+# Load API key(s) from environment
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
-if not GOOGLE_API_KEY:
+if not (GOOGLE_API_KEY or os.getenv("GOOGLE_API_KEYS")):
     raise ValueError("GOOGLE_API_KEY not found in .env")
 
-# Configure Gemini
-genai.configure(api_key=GOOGLE_API_KEY)
-
-# Choose a working model
-MODEL_NAME = "gemini-2.5-flash"  # or use any model from the list you printed
-model = genai.GenerativeModel(MODEL_NAME)
-
-async def call_gemini_chat(prompt: str) -> str:
+async def call_gemini_chat(prompt: str, call_site: str = "default", cache_prefix: str = None) -> str:
     """
     Call Google Gemini to generate a response for the given prompt.
+
+    `call_site` selects the model tier and is used for per-tier latency and
+    cost accounting (see llm_router). Raises SchedulerRejected when the call
+    is refused or shed by the priority scheduler.
+
+    `cache_prefix`, when given, is the stable part of the prompt and is sent
+    ahead of `prompt` (see prompt_assembly / llm_router caching).
     """
     try:
-        # Generate content
-        response = model.generate_content(prompt)
-        return response.text.strip()
+        # Generate content on the routed tier / least-loaded key
+        return await routed_generate(prompt, call_site=call_site, cache_prefix=cache_prefix)
+    except SchedulerRejected:
+        # admission control decisions are for the caller to handle
+        raise
     except Exception as e:
         # Handle errors gracefully
         print(f"Gemini API call failed: {str(e)}")
@@ -5,6 +5,7 @@ from components.role_selector import select_role_experience
 from components.voice_input import get_voice_input, speak_text
 from services.api import post_interview
 import hashlib
+import uuid
 
 # ---------------------------
 # App Config
@@ -42,6 +43,10 @@ if "interview_ended" not in st.session_state:
     st.session_state.interview_ended = False
 if "user_input" not in st.session_state:
     st.session_state.user_input = ""
+if "session_id" not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
+if "last_turn_id" not in st.session_state:
+    st.session_state.last_turn_id = ""
 
 TOTAL_TURNS = 10
 
@@ -85,11 +90,23 @@ st.progress(min(st.session_state.turn_count / TOTAL_TURNS, 1.0))
 # ---------------------------
 # Handle User Answer
 # ---------------------------
+def make_turn_id(turn_count, answer_text):
+    """Stable idempotency key for one answer submission"""
+    raw = f"{st.session_state.session_id}:{turn_count}:{answer_text.strip()}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:32]
+
+
 def handle_answer(answer_text):
     """Process user answer and update chat"""
     if not answer_text.strip():
         return
 
+    # on_change and the voice button can both fire for the same answer
+    turn_id = make_turn_id(st.session_state.turn_count, answer_text)
+    if turn_id == st.session_state.last_turn_id:
+        return
+    st.session_state.last_turn_id = turn_id
+
     # Append user's answer
     st.session_state.history.append({"from": "user", "text": answer_text})
 
@@ -100,7 +117,9 @@ def handle_answer(answer_text):
         "last_question": st.session_state.question,
         "user_answer": answer_text,
         "history": st.session_state.history,
-        "turn_count": st.session_state.turn_count
+        "turn_count": st.session_state.turn_count,
+        "session_id": st.session_state.session_id,
+        "client_turn_id": turn_id
     }
 
     res = post_interview(payload)
@@ -125,7 +144,9 @@ if st.session_state.turn_count == 1 and not st.session_state.question:
         "last_question": "",
         "user_answer": "",
         "history": st.session_state.history,
-        "turn_count": st.session_state.turn_count
+        "turn_count": st.session_state.turn_count,
+        "session_id": st.session_state.session_id,
+        "client_turn_id": make_turn_id(st.session_state.turn_count, "")
     }
     res = post_interview(payload)
     first_question = res.get("interviewer_reply", "Let's start the interview!")
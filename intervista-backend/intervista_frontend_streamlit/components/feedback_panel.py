@@ -8,6 +8,9 @@ def display_feedback(feedback):
 
     st.markdown("### 📝 Post-Interview Feedback")
 
+    if feedback.get("provisional"):
+        st.caption("Provisional scores (quick local estimate, not yet reviewed by the AI interviewer)")
+
     # Overall Score
     score = feedback.get("score")
     st.markdown(f"**Overall Score:** {score if score is not None else '-'} / 10")
@@ -0,0 +1,59 @@
+"""
+Replay captured /api/interview traffic against the current build.
+
+Capture first by running the backend with TRAFFIC_CAPTURE_PATH set, e.g.
+
+    TRAFFIC_CAPTURE_PATH=capture.jsonl.gz uvicorn app.main:app
+
+then replay offline (no API key or network needed; LLM responses come from
+the capture):
+
+    python replay_traffic.py capture.jsonl.gz --speedup 10 --concurrency 16
+
+Prints throughput, latency percentiles and parse-failure / fallback rates as
+JSON, so two builds can be compared on the same traffic.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+
+# Replay never reaches the provider, and must not re-capture itself
+os.environ.setdefault("GOOGLE_API_KEY", "replay")
+os.environ.pop("TRAFFIC_CAPTURE_PATH", None)
+
+from fastapi import HTTPException
+
+from app.endpoints import InterviewRequest, interview
+from app.llm_router import set_llm_transport
+from app.traffic_capture import ReplayTransport, load_capture, replay_capture
+
+
+async def handle(body):
+    try:
+        result = await interview(InterviewRequest(**body))
+        return {"status": 200, "result": result}
+    except HTTPException as e:
+        return {"status": e.status_code, "result": None}
+
+
+async def main(args):
+    records = load_capture(args.path)
+    if not records:
+        raise SystemExit(f"No records in {args.path}")
+    transport = ReplayTransport(records, speedup=args.speedup)
+    set_llm_transport(transport)
+    report = await replay_capture(records, handle, transport,
+                                  speedup=args.speedup, concurrency=args.concurrency)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay captured interview traffic.")
+    parser.add_argument("path", help="capture file (.jsonl or .jsonl.gz)")
+    parser.add_argument("--speedup", type=float, default=1.0,
+                        help="divide recorded inter-arrival times and LLM latencies by this")
+    parser.add_argument("--concurrency", type=int, default=8,
+                        help="maximum requests in flight")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,190 @@
+"""
+Check RespBackend against a small in-process RESP server.
+
+Runs without Redis: the stand-in below speaks just enough of the protocol
+(AUTH, SELECT, MGET, SET with PX, DEL) for the shared-state backend, and
+counts how many network round-trips each batch needs. Also checks that a
+turn landing back on a worker with a stale pre-generation still reuses the
+one another worker left in shared state.
+
+    python test_shared_state.py
+"""
+
+import asyncio
+import time
+
+from app import speculation
+from app.shared_state import InProcessBackend, RespBackend, StateBackendError
+
+
+class RespStandIn:
+    """Minimal RESP server backed by a dict, with expiry and a password."""
+
+    def __init__(self, password=None):
+        self.password = password
+        self.store = {}
+        self.reads = 0
+        self.server = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._serve, "127.0.0.1", 0)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    @staticmethod
+    async def _read_command(reader):
+        line = await reader.readline()
+        if not line:
+            return None
+        args = []
+        for _ in range(int(line[1:-2])):
+            size = int((await reader.readline())[1:-2])
+            args.append((await reader.readexactly(size + 2))[:-2])
+        return args
+
+    def _get(self, key):
+        entry = self.store.get(key)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires is not None and expires <= time.monotonic():
+            del self.store[key]
+            return None
+        return value
+
+    @staticmethod
+    def _bulk(value):
+        return b"$-1\r\n" if value is None else b"$%d\r\n%s\r\n" % (len(value), value)
+
+    def _execute(self, args, authed):
+        cmd = args[0].upper()
+        if cmd == b"AUTH":
+            if args[1].decode() != self.password:
+                return b"-ERR invalid password\r\n", False
+            return b"+OK\r\n", True
+        if self.password and not authed:
+            return b"-NOAUTH Authentication required\r\n", authed
+        if cmd == b"SELECT":
+            return b"+OK\r\n", authed
+        if cmd == b"MGET":
+            return b"*%d\r\n" % (len(args) - 1) + b"".join(self._bulk(self._get(k)) for k in args[1:]), authed
+        if cmd == b"SET":
+            expires = None
+            if len(args) > 3 and args[3].upper() == b"PX":
+                expires = time.monotonic() + int(args[4]) / 1000
+            self.store[args[1]] = (expires, args[2])
+            return b"+OK\r\n", authed
+        if cmd == b"DEL":
+            removed = sum(self.store.pop(k, None) is not None for k in args[1:])
+            return b":%d\r\n" % removed, authed
+        return b"-ERR unknown command '%s'\r\n" % cmd, authed
+
+    async def _serve(self, reader, writer):
+        authed = False
+        try:
+            while True:
+                args = await self._read_command(reader)
+                if args is None:
+                    break
+                if not reader._buffer:
+                    # nothing else buffered: the client is waiting on this batch
+                    self.reads += 1
+                reply, authed = self._execute(args, authed)
+                writer.write(reply)
+                await writer.drain()
+        except (asyncio.CancelledError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+async def check_backend(backend):
+    await backend.set_many({"a": {"x": 1}, "b": [1, 2], "c": "text"})
+    assert await backend.get_many(["a", "b", "c", "missing"]) == {"a": {"x": 1}, "b": [1, 2], "c": "text"}
+
+    await backend.set_many({"short": 1}, ttl=0.2)
+    assert await backend.get_many(["short"]) == {"short": 1}
+    await asyncio.sleep(0.3)
+    assert await backend.get_many(["short"]) == {}
+
+    await backend.delete_many(["a", "missing"])
+    assert await backend.get_many(["a", "b"]) == {"b": [1, 2]}
+
+
+async def main():
+    # the in-process backend defines the expected behaviour
+    await check_backend(InProcessBackend())
+
+    server = RespStandIn(password="secret")
+    port = await server.start()
+    backend = RespBackend(f"redis://:secret@127.0.0.1:{port}/2", pool_size=2)
+    try:
+        await check_backend(backend)
+
+        # a batch of writes is one pipelined round-trip
+        before = server.reads
+        await backend.set_many({f"k{i}": i for i in range(50)})
+        assert server.reads - before == 1, server.reads - before
+        assert len(await backend.get_many([f"k{i}" for i in range(50)])) == 50
+
+        # an error reply is raised, and the connection stays usable
+        try:
+            await backend._pipeline([b"*1\r\n$4\r\nPING\r\n"])
+            raise AssertionError("expected an error reply")
+        except StateBackendError:
+            pass
+        assert await backend.get_many(["b"]) == {"b": [1, 2]}
+
+        # concurrent batches share the pool without mixing replies
+        results = await asyncio.gather(*[backend.get_many([f"k{i}"]) for i in range(20)])
+        assert results == [{f"k{i}": i} for i in range(20)]
+
+        # a wrong password fails the connection
+        try:
+            await RespBackend(f"redis://:wrong@127.0.0.1:{port}").get_many(["b"])
+            raise AssertionError("expected an auth failure")
+        except StateBackendError:
+            pass
+    finally:
+        await backend.close()
+        await server.stop()
+    print("RespBackend OK")
+
+
+async def check_cross_worker_speculation():
+    """A stale local pre-generation must not hide a current shared record."""
+    async def make_question(qtype):
+        return f"local {qtype} question"
+
+    # this worker pre-generated for turn 2; turn 2 then ran on another worker,
+    # which left a record for turn 3 in shared state
+    speculation.schedule_speculation("s1", 2, ["technical"], make_question)
+    await asyncio.sleep(0)
+    shared = {"for_turn": 3, "questions": {"technical": "shared technical question"}}
+    before = dict(speculation._metrics)
+    question = await speculation.take_speculated_question("s1", 3, "technical", shared)
+    assert question == "shared technical question", question
+    assert speculation._metrics["shared_hits"] - before["shared_hits"] == 1
+    assert speculation._metrics["stale"] == before["stale"]
+
+    # without a shared record the stale local entry still counts as stale
+    speculation.schedule_speculation("s2", 2, ["technical"], make_question)
+    assert await speculation.take_speculated_question("s2", 3, "technical") is None
+    assert speculation._metrics["stale"] - before["stale"] == 1
+    print("cross-worker speculation OK")
+
+
+def test_resp_backend():
+    asyncio.run(main())
+
+
+def test_cross_worker_speculation():
+    asyncio.run(check_cross_worker_speculation())
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
+    asyncio.run(check_cross_worker_speculation())